@@ -0,0 +1,62 @@
+import queue
+import threading
+import torch
+
+
+class BatchPrefetcher:
+    """Samples batches from the replay buffer on a background thread, so training never waits on sampling.
+    Keeps up to n_batches gathered, contiguous and (optionally) pinned batches ready.
+    Exposes the same sample methods as ReplayBuffer, so it can be passed to train_batch in its place.
+    With a prioritized buffer the batches come from sample_prioritized, and priority updates are passed through.
+    An exception raised while sampling ends the thread and is raised again from sample, instead of hanging the trainer.
+    """
+
+    def __init__(self, buffer, batch_size: int, n_batches: int, pin_memory: bool):
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.batches = queue.Queue(maxsize=n_batches)
+        thread = threading.Thread(target=self._loop, daemon=True)
+        thread.start()
+
+    def sample(self, batch_size: int) -> tuple:
+        assert (
+            batch_size == self.batch_size
+        ), f"Prefetching batches of size {self.batch_size}, but {batch_size} were requested"
+        batch = self.batches.get()
+        if isinstance(batch, Exception):
+            self.batches.put(batch)  # Every later call raises it too
+            raise batch
+
+        return batch
+
+    def sample_prioritized(self, batch_size: int) -> tuple:
+        return self.sample(batch_size)
+
+    def update_priorities(self, indices: torch.Tensor, errors: torch.Tensor) -> None:
+        self.buffer.update_priorities(indices, errors)
+
+    def _loop(self) -> None:
+        sample = (
+            self.buffer.sample_prioritized
+            if self.buffer.prioritized
+            else self.buffer.sample
+        )
+        try:
+            while True:
+                batch = sample(self.batch_size)
+                batch = tuple(self._prepare(tensor) for tensor in batch)
+                self.batches.put(batch)
+        except Exception as exception:
+            self.batches.put(exception)
+
+    def _prepare(self, tensor: torch.Tensor) -> torch.Tensor:
+        tensor = tensor.contiguous()
+
+        if self.pin_memory:
+            tensor = tensor.pin_memory()
+
+        return tensor
+
+    def __len__(self) -> int:
+        return len(self.buffer)
@@ -2,117 +2,448 @@ import numpy as np
 import torch
 import torch.multiprocessing as mp
 import warnings
+import os
+from typing import Union
+from BufferCheckpointer import BufferCheckpointer
+from ReplayStorage import FIELDS, get_storage
+from SumTree import SumTree
 
 
 class ReplayBuffer:
+    """Replay buffer shared between the inference and training processes.
+    The rows live either in anonymous shared memory (backend "shared_memory") or in one memory-mapped file
+    per field (backend "mmap"). With "mmap", ptr/size are mirrored to a small header file, so a restart only
+    has to map the files again, and max_size can exceed the physical memory.
+    The storage layout (float32 or compact, see ReplayStorage) decides which tensors hold the rows;
+    rows are encoded in extend and decoded back to float32 in sample.
+    Writers only hold the lock to reserve a contiguous slot range and to commit it, the rows themselves are
+    copied outside of it. Reserved ranges are tracked in the shared in_flight table, and never sampled.
+    The in_flight table is not persisted, so if a process dies mid-write with the "mmap" backend and a full buffer,
+    the rows of its range are left half-written and are sampled after a restart.
+    """
+
     def __init__(self, config):
         self.max_size = config["replay_buffer"]["max_size"]
+        self.backend = config["replay_buffer"].get("backend", "shared_memory")
+        self.storage_dir = config["replay_buffer"].get(
+            "storage_dir", "replay_buffer_storage"
+        )
         self.lock = mp.Lock()
         self.ptr = mp.Value("i", 0)
         self.size = mp.Value("i", 0)
+        self.n_written = mp.Value("q", 0)  # Total number of rows ever reserved
+        # (first row as a count of rows ever reserved, number of rows) of every range being written, 0 rows if free
+        self.in_flight = torch.zeros(
+            (
+                config["replay_buffer"].get(
+                    "max_concurrent_writers", config["inference"]["n_processes"]
+                ),
+                2,
+            ),
+            dtype=torch.int64,
+        ).share_memory_()
+        self.storage = get_storage(config)
+        self.field_specs = self.storage.field_specs(self.max_size)
+        self.storage_fields = list(self.field_specs)
+        self.reanalyse = config.get("reanalyse", {}).get("enabled", False)
+        if self.reanalyse:
+            self.field_specs.update(self._episode_field_specs())
 
-        (
-            self.bay,
-            self.flat_T,
-            self.prob,
-            self.value,
-            self.containers_left,
-            self.mask,
-        ) = self._create_buffers(self.max_size, config)
+        if self.backend == "mmap":
+            self._map_buffers(restore_header=True)
+        else:
+            self._create_buffers()
 
         if config["replay_buffer"]["checkpoint_path"]:
             self.load_from_disk(config)
 
+        # Counters for the RateLimiter
+        self.n_written_at_start = self.n_written.value
+        self.n_sampled = mp.Value("q", 0)
+
+        self.prioritized = config["replay_buffer"].get("prioritized", False)
+        if self.prioritized:
+            self.priority_alpha = config["replay_buffer"].get("priority_alpha", 0.6)
+            self.priority_beta = config["replay_buffer"].get("priority_beta", 0.4)
+            self.priority_eps = config["replay_buffer"].get("priority_eps", 1e-3)
+            self.priorities = SumTree(self.max_size)
+            # Priorities are not persisted, restored rows start out equally likely
+            self.priorities.update(np.arange(self.size.value), 1.0)
+
         self.config = config
 
-    def _create_buffers(self, max_size, config):
-        bay_size = (max_size, 1, config["env"]["R"], config["env"]["C"])
-        flat_T_size = (
-            max_size,
-            config["env"]["N"] * (config["env"]["N"] - 1) // 2,
-        )
-        prob_size = (max_size, 2 * config["env"]["R"] * config["env"]["C"])
-        value_size = (max_size, 1)
-        container_left_size = (max_size, 1)
-        mask_size = (max_size, 2 * config["env"]["R"] * config["env"]["C"])
-
-        bay = torch.zeros(bay_size, dtype=torch.float32).share_memory_()
-        flat_T = torch.zeros(flat_T_size, dtype=torch.float32).share_memory_()
-        prob = torch.zeros(prob_size, dtype=torch.float32).share_memory_()
-        value = torch.zeros(value_size, dtype=torch.float32).share_memory_()
-        containers_left = torch.zeros(
-            container_left_size, dtype=torch.float32
-        ).share_memory_()
-        mask = torch.zeros(mask_size, dtype=torch.float32).share_memory_()
+    def _episode_field_specs(self) -> dict[str, tuple[tuple, torch.dtype]]:
+        """Side columns from which ReanalyseProcess rebuilds the env state of a row:
+        the first row of its episode (as a count of rows ever reserved), the seed and (R, C, N) the env was reset with,
+        and the move index and action of the row."""
+        return {
+            "episode_id": ((self.max_size,), torch.int64),
+            "seed": ((self.max_size,), torch.int64),
+            "env_size": ((self.max_size, 3), torch.int16),
+            "move": ((self.max_size,), torch.int32),
+            "action": ((self.max_size,), torch.int16),
+        }
+
+    @staticmethod
+    def fill_value(name: str) -> int:
+        """Value of a field in rows that were never written by extend. A seed of -1 marks rows without an episode
+        record (e.g. rows restored from before reanalyse was enabled), which are never reanalysed."""
+        return -1 if name == "seed" else 0
+
+    def _create_buffers(self) -> None:
+        self.tensors = {
+            name: torch.full(shape, self.fill_value(name), dtype=dtype).share_memory_()
+            for name, (shape, dtype) in self.field_specs.items()
+        }
+
+    def _map_buffers(self, restore_header: bool) -> None:
+        os.makedirs(self.storage_dir, exist_ok=True)
+        self.tensors = {
+            name: torch.from_numpy(
+                self._open_memmap(
+                    f"{name}.bin",
+                    torch.empty(0, dtype=dtype).numpy().dtype,
+                    shape,
+                    self.fill_value(name),
+                )
+            )
+            for name, (shape, dtype) in self.field_specs.items()
+        }
+        header_exists = os.path.exists(os.path.join(self.storage_dir, "header.bin"))
+        # ptr, size, n_written
+        self.header = self._open_memmap("header.bin", np.int64, (3,))
+
+        if restore_header and header_exists:
+            self.ptr.value, self.size.value, self.n_written.value = self.header.tolist()
+
+    def _open_memmap(
+        self, file_name: str, dtype: np.dtype, shape: tuple, fill_value: int = 0
+    ) -> np.memmap:
+        path = os.path.join(self.storage_dir, file_name)
+        expected_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+        if not os.path.exists(path):
+            # New files are zero-filled, also when added next to the files of existing rows
+            memmap = np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+            if fill_value != 0:
+                memmap[:] = fill_value
+            return memmap
+
+        assert (
+            os.path.getsize(path) == expected_bytes
+        ), f"{path} does not match the configured buffer shape {shape}"
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _sync_header(self) -> None:
+        if self.backend == "mmap":
+            self.header[:] = self._committed_state()
+
+    def committed_state(self) -> tuple[int, int, int]:
+        """(ptr, size, n_written) as if no write was in flight, i.e. up to the first row that is not yet committed."""
+        with self.lock:
+            return self._committed_state()
 
-        return bay, flat_T, prob, value, containers_left, mask
+    def stable_rows(self) -> tuple[int, int]:
+        """Rows [first, end) (as counts of rows ever reserved) that are committed and whose slots are not being
+        overwritten, so they can be copied consistently while holding the lock."""
+        in_flight = self._active_in_flight()
+        _, _, end = self._committed_state()
+        reserved_end = int((in_flight[:, 0] + in_flight[:, 1]).max()) if len(in_flight) > 0 else end
+        return max(reserved_end - self.max_size, 0), end
+
+    def _committed_state(self) -> tuple[int, int, int]:
+        starts = self._active_in_flight()[:, 0]
+        n_written = int(starts.min()) if len(starts) > 0 else self.n_written.value
+        return n_written % self.max_size, min(n_written, self.max_size), n_written
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+
+        if self.backend == "mmap":
+            # The files are mapped again in the receiving process instead of copying the data
+            del state["tensors"]
+            del state["header"]
+
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+
+        if self.backend == "mmap":
+            self._map_buffers(restore_header=False)
+
+    def fields(self) -> dict[str, torch.Tensor]:
+        return self.tensors
 
     def load_from_disk(self, config):
-        try:
-            data = torch.load(config["replay_buffer"]["checkpoint_path"])
-            self.bay = data["bay"]
-            self.flat_T = data["flat_T"]
-            self.prob = data["prob"]
-            self.value = data["value"]
-            self.containers_left = data["containers_left"]
-            self.mask = data["mask"]
+        path = config["replay_buffer"]["checkpoint_path"]
+
+        if os.path.isdir(path):
+            BufferCheckpointer.load(self, path)
+            self._sync_header()
+        elif os.path.isfile(path):
+            # Checkpoint written as a single file by earlier versions
+            data = torch.load(path)
+            for start in range(0, self.max_size, 100000):
+                rows = {name: data[name][start : start + 100000] for name in FIELDS}
+                for name, encoded in self.storage.encode(rows).items():
+                    self.tensors[name][start : start + 100000] = encoded
+            if self.reanalyse:
+                # The file has no episode records
+                self.tensors["seed"].fill_(-1)
             self.ptr.value = data["ptr"]
             self.size.value = data["size"]
-        except FileNotFoundError:
-            warnings.warn(
-                f"Could not find file at {config['replay_buffer']['checkpoint_path']}"
+            # Keeps n_written % max_size == ptr, which the incremental checkpoints rely on
+            self.n_written.value = data["ptr"] + (
+                self.max_size if data["size"] == self.max_size else 0
             )
-
-    def save_to_disk(self):
-        data = {
-            "bay": self.bay,
-            "flat_T": self.flat_T,
-            "prob": self.prob,
-            "value": self.value,
-            "containers_left": self.containers_left,
-            "mask": self.mask,
-            "ptr": self.ptr.value,
-            "size": self.size.value,
-        }
-        torch.save(data, f"replay_buffer_checkpoint.pt")
+            self._sync_header()
+        else:
+            warnings.warn(f"Could not find checkpoint at {path}")
 
     def extend(
         self,
-        observations: list,
+        observations: Union[dict[str, torch.Tensor], list],
     ) -> None:
+        """Adds an episode, either as a block of columns keyed like FIELDS (see EpisodeRecorder)
+        or as a list of (bay, flat_T, prob, containers_left, mask, value) rows."""
+        columns = (
+            self._shape_columns(observations)
+            if isinstance(observations, dict)
+            else self._to_columns(observations)
+        )
+        # Only the last max_size rows of an episode longer than the buffer would survive
+        columns = {name: column[-self.max_size :] for name, column in columns.items()}
+        rows = self.storage.encode(columns)
+        n_rows = len(rows["value"])
+
+        if self.reanalyse:
+            rows.update(self._episode_columns(observations, n_rows))
+
+        with self.lock:
+            start = self.n_written.value
+            if self.reanalyse:
+                rows["episode_id"] = torch.full((n_rows,), start)
+            slot = self._reserve_slot(start, n_rows)
+            self.ptr.value = (self.ptr.value + n_rows) % self.max_size
+            self.size.value = min(self.size.value + n_rows, self.max_size)
+            self.n_written.value += n_rows
+
+            if slot is None:  # Every slot of the in_flight table is taken, write under the lock instead
+                self._write_rows(start, rows)
+                self._commit(start, n_rows)
+                return
+
+        self._write_rows(start, rows)
+
         with self.lock:
-            for obs in observations:
-                (bay, flat_T, prob, containers_left, mask, value) = obs
-                self.bay[self.ptr.value] = bay
-                self.flat_T[self.ptr.value] = flat_T
-                self.prob[self.ptr.value] = prob
-                self.value[self.ptr.value] = value
-                self.containers_left[self.ptr.value] = containers_left
-                self.mask[self.ptr.value] = mask
-                self.ptr.value = (self.ptr.value + 1) % self.max_size
-                self.size.value = min(self.size.value + 1, self.max_size)
-
-                if (
-                    self.ptr.value
-                    % self.config["train"]["save_buffer_every_n_observations"]
-                    == 0
-                ):
-                    self.save_to_disk()
+            self.in_flight[slot] = 0
+            self._commit(start, n_rows)
+
+    def _episode_columns(
+        self, observations: Union[dict[str, torch.Tensor], list], n_rows: int
+    ) -> dict[str, torch.Tensor]:
+        if isinstance(observations, dict) and "seed" in observations:
+            return {
+                name: observations[name][-n_rows:].to(dtype)
+                for name, (_, dtype) in self._episode_field_specs().items()
+                if name != "episode_id"
+            }
+
+        # Rows without an episode record are never reanalysed
+        return {
+            "seed": torch.full((n_rows,), -1),
+            "env_size": torch.zeros((n_rows, 3), dtype=torch.int16),
+            "move": torch.zeros(n_rows, dtype=torch.int32),
+            "action": torch.zeros(n_rows, dtype=torch.int16),
+        }
+
+    def _reserve_slot(self, start: int, n_rows: int) -> Union[int, None]:
+        in_flight = self.in_flight.numpy()
+        free = np.flatnonzero(in_flight[:, 1] == 0)
+        if len(free) == 0:
+            return None
+
+        in_flight[free[0]] = (start, n_rows)
+        if self.prioritized:
+            # Zero priority keeps the reserved rows from being sampled until they are written
+            self.priorities.update(self._positions(start, n_rows), 0.0)
+
+        return free[0]
+
+    def _write_rows(self, start: int, rows: dict[str, torch.Tensor]) -> None:
+        """Copies the rows into the buffer from row start (as a count of rows ever reserved), wrapping around the end"""
+        first = start % self.max_size
+        n_rows = len(rows["value"])
+        n_before_end = min(n_rows, self.max_size - first)
+
+        for name, tensor in self.tensors.items():
+            tensor[first : first + n_before_end] = rows[name][:n_before_end]
+            tensor[: n_rows - n_before_end] = rows[name][n_before_end:]
+
+    def _commit(self, start: int, n_rows: int) -> None:
+        if self.prioritized:
+            # New rows get the highest priority seen so far, so they are sampled at least once
+            self.priorities.update(
+                self._positions(start, n_rows), self.priorities.max_priority.value
+            )
+
+        self._sync_header()
+
+    def _positions(self, start: int, n_rows: int) -> np.ndarray:
+        return (start + np.arange(n_rows)) % self.max_size
 
     def sample(self, batch_size: int) -> tuple:
-        if self.size.value < batch_size:
-            batch_size = self.size.value
+        with self.lock:
+            indices = self._sample_indices(self.size.value, batch_size)
+            rows = {name: self.tensors[name][indices] for name in self.storage_fields}
+
+        rows = self.storage.decode(rows)
+        return tuple(rows[name] for name in FIELDS)
+
+    def sample_prioritized(self, batch_size: int) -> tuple:
+        """Samples rows proportionally to their priority. Returns the fields as sample does, followed by
+        the sampled indices (for update_priorities) and the normalized importance-sampling weights."""
+        with self.lock:
+            indices = self._sample_prioritized_indices(batch_size)
+            probabilities = self.priorities.get(indices) / self.priorities.total
+            rows = {name: self.tensors[name][indices] for name in self.storage_fields}
+            size = self.size.value
+
+        weights = (size * probabilities) ** -self.priority_beta
+        weights = torch.from_numpy(weights / weights.max()).float()
+        rows = self.storage.decode(rows)
+        return tuple(rows[name] for name in FIELDS) + (
+            torch.from_numpy(indices),
+            weights,
+        )
+
+    def update_priorities(self, indices: torch.Tensor, errors: torch.Tensor) -> None:
+        priorities = (errors.double().cpu().numpy() + self.priority_eps) ** (
+            self.priority_alpha
+        )
+        indices = indices.cpu().numpy()
+        # Duplicates would make the level-wise tree update ambiguous, keep the first of each
+        indices, first = np.unique(indices, return_index=True)
+
+        with self.lock:
+            # Rows reserved by a writer since they were sampled must keep their zero priority until committed
+            committed = self._is_committed(indices, self._active_in_flight())
+            self.priorities.update(indices[committed], priorities[first][committed])
+
+    def sample_for_reanalyse(self) -> Union[dict, None]:
+        """Picks a random committed row and returns what is needed to replay its episode up to it:
+        index, episode_id, seed, env_size and the actions taken before the row.
+        Returns None if the row has no episode record, or the earlier rows of its episode were overwritten."""
+        with self.lock:
+            indices = self._sample_indices(self.size.value, 1)
+            if len(indices) == 0:
+                return None
+
+            index = indices[0]
+            seed = self.tensors["seed"][index].item()
+            if seed < 0:
+                return None
+
+            episode_id = self.tensors["episode_id"][index].item()
+            move = self.tensors["move"][index].item()
+            positions = self._positions(index - move, move + 1)
+            is_intact = (
+                (self.tensors["episode_id"][positions] == episode_id).all()
+                and (self.tensors["move"][positions] == torch.arange(move + 1)).all()
+                and self._is_committed(positions, self._active_in_flight()).all()
+            )
+            if not is_intact:
+                return None
+
+            return {
+                "index": index,
+                "episode_id": episode_id,
+                "seed": seed,
+                "env_size": self.tensors["env_size"][index].tolist(),
+                "actions": self.tensors["action"][positions[:-1]].tolist(),
+            }
+
+    def update_prob(self, index: int, episode_id: int, prob: torch.Tensor) -> bool:
+        """Overwrites the policy target of a row, unless the row was overwritten by another episode since it was sampled"""
+        encoded = self.storage.encode_prob(prob.float().unsqueeze(0))
 
         with self.lock:
-            indices = np.random.choice(self.size.value, batch_size, replace=False)
-            return (
-                self.bay[indices],
-                self.flat_T[indices],
-                self.prob[indices],
-                self.value[indices],
-                self.containers_left[indices],
-                self.mask[indices],
+            is_same_row = (
+                self.tensors["episode_id"][index].item() == episode_id
+                and self._is_committed(np.array([index]), self._active_in_flight())[0]
             )
+            if is_same_row:
+                for name, tensor in encoded.items():
+                    self.tensors[name][index] = tensor[0]
+
+        return is_same_row
+
+    def _sample_prioritized_indices(self, batch_size: int) -> np.ndarray:
+        """Draws from the sum-tree and redraws any index that is out of range, in flight or has zero priority
+        (only reachable through rounding at the segment edges). Returns fewer indices only if no row can be drawn.
+        Must be called under the lock."""
+        in_flight = self._active_in_flight()
+        indices = np.empty(0, dtype=np.int64)
+
+        while len(indices) < batch_size and self.priorities.total > 0:
+            extra = self.priorities.sample(batch_size - len(indices))
+            extra = extra[extra < self.size.value]
+            extra = extra[self._is_committed(extra, in_flight)]
+            extra = extra[self.priorities.get(extra) > 0]
+            indices = np.concatenate([indices, extra])
+
+        return indices
+
+    def _sample_indices(self, size: int, batch_size: int) -> np.ndarray:
+        """Distinct committed indices in O(batch_size) by rejection, instead of permuting all rows as np.random.choice does.
+        Sorted, which also makes the gather more cache friendly. Must be called under the lock."""
+        in_flight = self._active_in_flight()
+        n_committed = size - int(in_flight[:, 1].sum())
+
+        if 2 * batch_size > n_committed:
+            indices = np.random.permutation(size)
+            indices = indices[self._is_committed(indices, in_flight)][:batch_size]
+            return np.sort(indices)
+
+        indices = np.empty(0, dtype=np.int64)
+        while len(indices) < batch_size:
+            extra = np.random.randint(size, size=batch_size - len(indices))
+            extra = extra[self._is_committed(extra, in_flight)]
+            indices = np.unique(np.concatenate([indices, extra]))
+
+        return indices
+
+    def _active_in_flight(self) -> np.ndarray:
+        in_flight = self.in_flight.numpy()
+        return in_flight[in_flight[:, 1] > 0]
+
+    def _is_committed(self, indices: np.ndarray, in_flight: np.ndarray) -> np.ndarray:
+        offsets = (indices[:, None] - in_flight[None, :, 0]) % self.max_size
+        return ~(offsets < in_flight[None, :, 1]).any(axis=1)
+
+    def _to_columns(self, observations: list) -> dict[str, torch.Tensor]:
+        bay, flat_T, prob, containers_left, mask, value = zip(*observations)
+        return self._shape_columns(
+            {
+                "bay": torch.stack(bay),
+                "flat_T": torch.stack(flat_T),
+                "prob": torch.stack(prob),
+                "value": torch.stack(value),
+                "containers_left": torch.stack(containers_left),
+                "mask": torch.stack(mask),
+            }
+        )
+
+    def _shape_columns(
+        self, columns: dict[str, torch.Tensor]
+    ) -> dict[str, torch.Tensor]:
+        row_shapes = self.storage.row_shapes()
+        return {
+            name: columns[name].float().reshape((-1,) + row_shapes[name])
+            for name in FIELDS
+        }
 
     def __len__(self):
-        return self.size.value
+        """Number of committed rows"""
+        return self.size.value - int(self.in_flight[:, 1].sum())
@@ -0,0 +1,171 @@
+import os
+import glob
+import time
+import threading
+import numpy as np
+import torch
+
+
+class BufferCheckpointer:
+    """Checkpoints a ReplayBuffer to a directory on a background thread.
+    The buffer is stored in chunks of chunk_size rows, and only the chunks written since the last checkpoint are saved.
+    Chunks are copied under the buffer lock one at a time and serialized outside of it. A chunk overlapping a range that
+    is still being written (which, once the buffer is full, overwrites committed rows) is copied after the writer commits.
+    Every chunk file is versioned by the checkpoint generation, and header.pt, which names the current version of each chunk,
+    is replaced last. A crash mid-checkpoint therefore leaves the previous checkpoint intact.
+    """
+
+    def __init__(self, buffer, config: dict) -> None:
+        self.buffer = buffer
+        self.directory = config["replay_buffer"].get(
+            "checkpoint_dir", "replay_buffer_checkpoint"
+        )
+        self.chunk_size = config["replay_buffer"].get(
+            "checkpoint_chunk_size", config["train"]["save_buffer_every_n_observations"]
+        )
+        self.every_n_observations = config["train"]["save_buffer_every_n_observations"]
+        self.generation = 0
+        self.chunk_versions = {}
+        self.last_n_written = None
+        os.makedirs(self.directory, exist_ok=True)
+        self._resume_from_directory(config)
+
+    def start(self) -> None:
+        thread = threading.Thread(target=self._loop, daemon=True)
+        thread.start()
+
+    def checkpoint(self) -> None:
+        # Rows after the first write still in flight are left to the next checkpoint
+        ptr, size, n_written = self.buffer.committed_state()
+
+        self.generation += 1
+        for chunk in self._dirty_chunks(n_written, size):
+            self._save_chunk(chunk)
+            self.chunk_versions[chunk] = self.generation
+
+        header = {
+            "ptr": ptr,
+            "size": size,
+            "n_written": n_written,
+            "max_size": self.buffer.max_size,
+            "chunk_size": self.chunk_size,
+            "generation": self.generation,
+            "chunk_versions": self.chunk_versions,
+        }
+        self._atomic_save(header, os.path.join(self.directory, "header.pt"))
+        self._remove_stale_chunks()
+        self.last_n_written = n_written
+
+    @staticmethod
+    def load(buffer, directory: str) -> dict:
+        """Restores the buffer contents and its ptr/size state from a checkpoint directory."""
+        header = torch.load(os.path.join(directory, "header.pt"))
+        assert (
+            header["max_size"] == buffer.max_size
+        ), f"Checkpoint has max_size {header['max_size']}, but the buffer has {buffer.max_size}"
+
+        for chunk, version in header["chunk_versions"].items():
+            data = torch.load(BufferCheckpointer._chunk_path(directory, chunk, version))
+            start = chunk * header["chunk_size"]
+            n_rows = len(data["value"])
+            for name, tensor in buffer.fields().items():
+                if name in data:
+                    tensor[start : start + n_rows] = data[name]
+                else:  # A side column of reanalyse, which was disabled when the checkpoint was written
+                    tensor[start : start + n_rows] = buffer.fill_value(name)
+
+        buffer.ptr.value = header["ptr"]
+        buffer.size.value = header["size"]
+        buffer.n_written.value = header["n_written"]
+        return header
+
+    def _loop(self) -> None:
+        while True:
+            if self._should_checkpoint():
+                self.checkpoint()
+            else:
+                time.sleep(1)
+
+    def _should_checkpoint(self) -> bool:
+        _, _, n_written = self.buffer.committed_state()
+        if self.last_n_written is None:
+            return n_written > 0
+
+        return n_written - self.last_n_written >= self.every_n_observations
+
+    def _resume_from_directory(self, config: dict) -> None:
+        """Keeps the existing chunk files if the buffer was restored from this directory."""
+        checkpoint_path = config["replay_buffer"]["checkpoint_path"]
+        header_path = os.path.join(self.directory, "header.pt")
+        if not checkpoint_path or not os.path.exists(header_path):
+            return
+        if os.path.abspath(checkpoint_path) != os.path.abspath(self.directory):
+            return
+
+        header = torch.load(header_path)
+        self.generation = header["generation"]
+        self.chunk_versions = header["chunk_versions"]
+        self.last_n_written = header["n_written"]
+
+    def _dirty_chunks(self, n_written: int, size: int) -> list[int]:
+        max_size = self.buffer.max_size
+        n_chunks = (max_size + self.chunk_size - 1) // self.chunk_size
+
+        if self.last_n_written is None:
+            start, count = 0, size
+        else:
+            start, count = self.last_n_written % max_size, n_written - self.last_n_written
+
+        if count >= max_size:
+            return list(range(n_chunks))
+        if count == 0:
+            return []
+
+        first_chunk = start // self.chunk_size
+        last_chunk = ((start + count - 1) % max_size) // self.chunk_size
+
+        if start + count <= max_size:
+            return list(range(first_chunk, last_chunk + 1))
+        else:  # The written rows wrap around the end of the buffer
+            return sorted(set(range(first_chunk, n_chunks)) | set(range(last_chunk + 1)))
+
+    def _save_chunk(self, chunk: int) -> None:
+        start = chunk * self.chunk_size
+        end = min(start + self.chunk_size, self.buffer.max_size)
+
+        positions = np.arange(start, end)
+
+        while True:
+            with self.buffer.lock:
+                in_flight = self.buffer._active_in_flight()
+                if self.buffer._is_committed(positions, in_flight).all():
+                    data = {
+                        name: tensor[start:end].clone()
+                        for name, tensor in self.buffer.fields().items()
+                    }
+                    break
+
+            time.sleep(0.01)
+
+        self._atomic_save(
+            data, self._chunk_path(self.directory, chunk, self.generation)
+        )
+
+    def _remove_stale_chunks(self) -> None:
+        current = {
+            self._chunk_path(self.directory, chunk, version)
+            for chunk, version in self.chunk_versions.items()
+        }
+        for path in glob.glob(os.path.join(self.directory, "chunk*_*.pt")):
+            if path not in current:
+                os.remove(path)
+
+    @staticmethod
+    def _chunk_path(directory: str, chunk: int, version: int) -> str:
+        return os.path.join(directory, f"chunk{chunk}_{version}.pt")
+
+    @staticmethod
+    def _atomic_save(data: dict, path: str) -> None:
+        temporary_path = path + ".tmp"
+        torch.save(data, temporary_path)
+        os.replace(temporary_path, path)
@@ -0,0 +1,101 @@
+import numpy as np
+import torch
+
+
+def _concat_bytes(states: list[tuple], field: int, dtype: np.dtype) -> torch.Tensor:
+    raw = bytearray(b"".join(state[field] for state in states))
+    return torch.from_numpy(np.frombuffer(raw, dtype=dtype))
+
+
+def _pad_bays(
+    bays: torch.Tensor,
+    R: torch.Tensor,
+    C: torch.Tensor,
+    remaining_ports: torch.Tensor,
+    max_R: int,
+    max_C: int,
+) -> torch.Tensor:
+    device = R.device
+    bays = bays.to(device).float()
+    ports = remaining_ports.repeat_interleave(R * C).float()
+    bays = torch.where(ports > 0, bays / ports.clamp(min=1), bays)
+
+    inside = (torch.arange(max_R, device=device)[None, :, None] < R[:, None, None]) & (
+        torch.arange(max_C, device=device)[None, None, :] < C[:, None, None]
+    )
+    padded = torch.full((len(R), max_R, max_C), -1.0, device=device)
+    # Boolean assignment fills row-major, which is the order of the unpadded bays
+    padded[inside] = bays
+    return padded.unsqueeze(1)
+
+
+def _pad_flat_ts(
+    flat_ts: torch.Tensor,
+    R: torch.Tensor,
+    C: torch.Tensor,
+    N: torch.Tensor,
+    max_N: int,
+) -> torch.Tensor:
+    device = N.device
+    flat_ts = flat_ts.to(device).float()
+    capacity = (R * C).repeat_interleave(N * (N - 1) // 2).float()
+
+    _, j = torch.triu_indices(max_N, max_N, offset=1, device=device)
+    # Entries (i, j) of the padded triangle with j < N are the unpadded triangle, in the same order
+    inside = j[None, :] < N[:, None]
+    padded = torch.zeros((len(N), max_N * (max_N - 1) // 2), device=device)
+    padded[inside] = flat_ts / capacity
+    return padded
+
+
+def _unpack_masks(
+    packed: torch.Tensor,
+    R: torch.Tensor,
+    C: torch.Tensor,
+    max_R: int,
+    max_C: int,
+) -> torch.Tensor:
+    device = R.device
+    packed = packed.to(device)
+    shifts = torch.arange(7, -1, -1, device=device, dtype=torch.uint8)
+    bits = ((packed[:, None] >> shifts) & 1).flatten()
+
+    n_bits = 2 * R * C
+    n_bytes = (n_bits + 7) // 8
+    starts = torch.cumsum(n_bytes, dim=0) * 8 - n_bytes * 8
+    owner = torch.repeat_interleave(torch.arange(len(R), device=device), n_bytes * 8)
+    # Drop the bits np.packbits appended to fill the last byte of each mask
+    is_used = torch.arange(len(bits), device=device) - starts[owner] < n_bits[owner]
+
+    inside = (
+        torch.arange(max_C, device=device)[None, None, :, None] < C[:, None, None, None]
+    ) & (
+        torch.arange(max_R, device=device)[None, None, None, :] < R[:, None, None, None]
+    )
+    inside = inside.expand(-1, 2, -1, -1)
+    padded = torch.zeros((len(R), 2, max_C, max_R), device=device)
+    padded[inside] = bits[is_used].float()
+    return padded.flatten(start_dim=1)
+
+
+def decode_compact_states(
+    states: list[tuple], config: dict, device: torch.device
+) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Pads and normalizes a batch of PaddedEnv.compact_state tuples on the device.
+    Returns the same (bay, flat_T, containers_left, mask) tensors as the padded float32 transport.
+    """
+    max_R = config["env"]["R"]
+    max_C = config["env"]["C"]
+    max_N = config["env"]["N"]
+
+    header = torch.tensor([state[:5] for state in states], dtype=torch.int64)
+    header = header.to(device)
+    R, C, N, remaining_ports, containers_left = header.unbind(dim=1)
+
+    bays = _pad_bays(
+        _concat_bytes(states, 5, np.uint8), R, C, remaining_ports, max_R, max_C
+    )
+    flat_ts = _pad_flat_ts(_concat_bytes(states, 6, np.int16), R, C, N, max_N)
+    masks = _unpack_masks(_concat_bytes(states, 7, np.uint8), R, C, max_R, max_C)
+
+    return bays, flat_ts, containers_left.float().unsqueeze(1), masks
@@ -0,0 +1,107 @@
+import torch
+from ReplayStorage import FIELDS
+
+
+class DeviceReplayMirror:
+    """Keeps a copy of the newest window_size rows of a ReplayBuffer on the training device, in the buffer's storage layout.
+    Row g (as a count of rows ever reserved) lives at position g % window_size. Before every batch the rows committed
+    since the last batch are copied over in chunks of sync_rows, so only new rows cross to the device. Each chunk is cloned
+    on the host under the buffer lock and transferred to the device after releasing it, so writers only wait for the clone.
+    Indices are drawn and gathered on the device (with replacement), and the rows decoded there.
+    Exposes the same sample method as ReplayBuffer, so it can be passed to train_batch in its place.
+    Rows are copied once, so the policy targets refreshed in place by the reanalyse workers would never reach the mirror,
+    and the two cannot be combined. The window defaults to 262144 rows (about 0.9 GB in float32 at the default env size),
+    as mirroring a full-size buffer would not fit on most devices.
+    """
+
+    def __init__(self, buffer, device: torch.device, config: dict) -> None:
+        assert not buffer.prioritized, "The device mirror samples uniformly"
+        assert not buffer.reanalyse, "The device mirror does not pick up rows refreshed by reanalyse"
+        window_size = config["train"].get("device_mirror_size", 262144)
+        assert window_size > 0, "train.device_mirror_size must be a positive number of rows"
+        self.buffer = buffer
+        self.device = device
+        self.window_size = min(window_size, buffer.max_size)
+        self.sync_rows = config["train"].get("device_mirror_sync_rows", 8192)
+        self.tensors = {
+            name: torch.zeros((self.window_size,) + shape[1:], dtype=dtype, device=device)
+            for name, (shape, dtype) in buffer.field_specs.items()
+            if name in buffer.storage_fields
+        }
+        # The mirror holds rows [self.first, self.end)
+        self.first = 0
+        self.end = 0
+        self.transferred_bytes = 0
+
+    def sample(self, batch_size: int) -> tuple:
+        self.sync()
+        indices = torch.randint(self.first, self.end, (batch_size,), device=self.device)
+        indices %= self.window_size
+        rows = self.buffer.storage.decode(
+            {name: tensor[indices] for name, tensor in self.tensors.items()}
+        )
+        return tuple(rows[name] for name in FIELDS)
+
+    def sync(self) -> None:
+        while self._sync_chunk():
+            pass
+
+    def pop_transferred_bytes(self) -> int:
+        """Bytes copied to the device since the last call"""
+        transferred_bytes = self.transferred_bytes
+        self.transferred_bytes = 0
+        return transferred_bytes
+
+    def _sync_chunk(self) -> bool:
+        """Copies up to sync_rows newly committed rows. Returns False once the mirror is up to date."""
+        with self.buffer.lock:
+            first, committed = self.buffer.stable_rows()
+            start = max(self.end, first, committed - self.window_size)
+            end = min(committed, start + self.sync_rows)
+            if end <= start:
+                return False
+
+            runs = self._clone_rows(start, end)
+
+        self._upload(runs)
+
+        if start > self.end:  # Rows in between were overwritten before they could be copied
+            self.first = start
+        self.end = end
+        self.first = max(self.first, self.end - self.window_size)
+        return True
+
+    def _clone_rows(self, start: int, end: int) -> list[tuple[int, dict[str, torch.Tensor]]]:
+        """Clones rows [start, end) as (window position, rows) runs, split where either the buffer or the window wraps around.
+        Must be called under the buffer lock."""
+        runs = []
+        position = start
+        while position < end:
+            source = position % self.buffer.max_size
+            target = position % self.window_size
+            n_rows = min(
+                end - position,
+                self.buffer.max_size - source,
+                self.window_size - target,
+            )
+            runs.append(
+                (
+                    target,
+                    {
+                        name: self.buffer.tensors[name][source : source + n_rows].clone()
+                        for name in self.tensors
+                    },
+                )
+            )
+            position += n_rows
+
+        return runs
+
+    def _upload(self, runs: list[tuple[int, dict[str, torch.Tensor]]]) -> None:
+        for target, rows in runs:
+            for name, tensor in self.tensors.items():
+                tensor[target : target + len(rows[name])] = rows[name].to(self.device)
+                self.transferred_bytes += rows[name].nbytes
+
+    def __len__(self) -> int:
+        return self.end - self.first
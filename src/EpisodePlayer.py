@@ -4,6 +4,11 @@ from multiprocessing.connection import Connection
 import torch
 import numpy as np
 from min_max import MinMaxStats
+from EpisodeRecorder import EpisodeRecorder
+from PhaseTimer import phase_timer
+from LogHistogram import LogHistogram
+from MemoryStats import memory_stats
+import time
 
 
 class EpisodePlayer:
@@ -18,52 +23,52 @@ class EpisodePlayer:
         self.conn = conn
         self.config = config
         self.deterministic = deterministic
-        self.observations = []
+        self.recorder = EpisodeRecorder(env, config)
+        self.search_times = LogHistogram()
         self.reused_tree = None
         self.transposition_table = {}
         self.n_removes = 0
         self.found_optimal_path = False
         self.min_max_stats = MinMaxStats()
+        self.memory_snapshot = memory_stats.snapshot()
+        self.peak_tree_size = 0
 
         if self.deterministic:
             np.random.seed(0)
 
     def run_episode(self):
-        placed = []
         while not self.env.terminated:
             action = self._get_action()
             if action >= self.env.C * self.env.R:
                 self.n_removes += 1
-            placed.append(self.env.containers_placed)
             self.env.step(action)
 
-        self._cleanup(placed)
+        self._cleanup()
+        n_moves = len(self.recorder)
 
         return (
-            self.observations,
+            self.recorder.finish(self.env),
             -self.env.containers_placed,
             self.env.total_reward,
-            self.n_removes / len(placed) if len(placed) > 0 else 0,
+            self.n_removes / n_moves if n_moves > 0 else 0,
         )
 
-    def _cleanup(self, placed: list[int]) -> None:
+    def memory_report(self) -> dict[str, float]:
+        """Search memory of the finished episode. Any leaked node or env is flagged by memory_leak"""
+        return {
+            "peak_tree_size": self.peak_tree_size,
+            "transposition_table_size": len(self.transposition_table),
+            **memory_stats.leaks_since(self.memory_snapshot),
+        }
+
+    def _cleanup(self) -> None:
+        start = phase_timer.start()
         if self.reused_tree is not None:
             close_envs_in_tree(self.reused_tree)
-
-        self._add_value_to_observations(placed)
-
-    def _add_observation(self, probabilities: torch.Tensor, env: Env) -> None:
-        self.observations.append(
-            [
-                torch.tensor(env.bay),
-                torch.tensor(env.flat_T),
-                probabilities,
-                torch.tensor([env.containers_left]),
-                torch.tensor(env.mask),
-            ]
-        )
+        phase_timer.stop("cleanup", start)
 
     def _get_action(self):
+        start = time.perf_counter()
         if self.found_optimal_path:
             probabilities = get_tree_probs(self.reused_tree, self.config)
         else:
@@ -80,8 +85,12 @@ class EpisodePlayer:
                 self.reused_tree,
                 self.transposition_table,
             )
-        self._add_observation(probabilities, self.env)
+        self.search_times.add(time.perf_counter() - start)
+        self.peak_tree_size = max(
+            self.peak_tree_size, memory_stats.live_nodes - self.memory_snapshot[0]
+        )
         action = torch.argmax(probabilities).item()
+        self.recorder.add(probabilities, self.env, action)
         self._update_tree(action)
         return action
 
@@ -91,14 +100,11 @@ class EpisodePlayer:
                 close_envs_in_tree(self.reused_tree.children[key])
 
     def _update_tree(self, action: int) -> None:
+        start = phase_timer.start()
         self._close_other_branches(action)
 
-        self.reused_tree.env.close()
+        self.reused_tree.close()
+        phase_timer.stop("cleanup", start)
         self.reused_tree = self.reused_tree.children[action]
         self.reused_tree.parent = None
         self.reused_tree.prior_prob = None
-
-    def _add_value_to_observations(self, placed: list[int]) -> None:
-        overall_placed = -self.env.containers_placed
-        for i in range(len(self.observations)):
-            self.observations[i] += [torch.tensor(overall_placed + placed[i])]
@@ -0,0 +1,75 @@
+import torch
+from MPSPEnv import Env
+
+
+class EpisodeRecorder:
+    """Records the observations of an episode into preallocated columns, one row per move.
+    The columns are sized R * C * N rows up front and doubled if an episode runs longer.
+    The finished episode is handed to ReplayBuffer.extend as one block of columns, keyed like ReplayStorage.FIELDS,
+    along with the seed, size, move index and action of every row, which the reanalyse workers replay the episode from.
+    """
+
+    def __init__(self, env: Env, config: dict) -> None:
+        self.max_R = config["env"]["R"]
+        self.max_C = config["env"]["C"]
+        self.max_N = config["env"]["N"]
+        self.n_rows = 0
+        self.columns = self._allocate(env.R * env.C * env.N)
+        self.placed = torch.zeros(len(self.columns["value"]), dtype=torch.float32)
+        self.actions = torch.zeros(len(self.columns["value"]), dtype=torch.int16)
+
+    def add(self, probabilities: torch.Tensor, env: Env, action: int) -> None:
+        if self.n_rows == len(self.placed):
+            self._grow()
+
+        i = self.n_rows
+        env.write_observation(
+            self.arrays["bay"][i, 0],
+            self.arrays["flat_T"][i],
+            self.arrays["containers_left"][i],
+            self.arrays["mask"][i],
+        )
+        self.columns["prob"][i] = probabilities
+        self.placed[i] = env.containers_placed
+        self.actions[i] = action
+        self.n_rows += 1
+
+    def finish(self, env: Env) -> dict[str, torch.Tensor]:
+        """Writes the value targets and returns the recorded rows"""
+        n = self.n_rows
+        torch.sub(
+            self.placed[:n], env.containers_placed, out=self.columns["value"][:n, 0]
+        )
+        block = {name: column[:n] for name, column in self.columns.items()}
+        block["seed"] = torch.full((n,), -1 if env.seed is None else env.seed)
+        block["env_size"] = torch.tensor([env.R, env.C, env.N]).repeat(n, 1)
+        block["move"] = torch.arange(n, dtype=torch.int32)
+        block["action"] = self.actions[:n]
+        return block
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def _allocate(self, n_rows: int) -> dict[str, torch.Tensor]:
+        n_actions = 2 * self.max_R * self.max_C
+        columns = {
+            "bay": torch.empty((n_rows, 1, self.max_R, self.max_C)),
+            "flat_T": torch.empty((n_rows, self.max_N * (self.max_N - 1) // 2)),
+            "prob": torch.empty((n_rows, n_actions)),
+            "value": torch.empty((n_rows, 1)),
+            "containers_left": torch.empty((n_rows, 1)),
+            "mask": torch.empty((n_rows, n_actions)),
+        }
+        # NumPy views of the same memory, written by PaddedEnv.write_observation
+        self.arrays = {name: column.numpy() for name, column in columns.items()}
+        return columns
+
+    def _grow(self) -> None:
+        n_rows = len(self.placed)
+        columns = self._allocate(2 * n_rows)
+        for name, column in self.columns.items():
+            columns[name][:n_rows] = column
+
+        self.columns = columns
+        self.placed = torch.cat([self.placed, torch.zeros(n_rows)])
+        self.actions = torch.cat([self.actions, torch.zeros_like(self.actions)])
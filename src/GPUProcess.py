@@ -1,9 +1,15 @@
 from Train import init_model
+from CompactTransport import decode_compact_states
 import numpy as np
 import torch
 from Train import PretrainedModel
 import torch.multiprocessing as mp
 from typing import Union
+from Logging import init_wandb_run
+from StepLogger import StepLogger
+from ProfilerTrigger import ProfilerTrigger
+from MetricsSink import get_metrics_sink
+import time
 
 
 class GPUProcess:
@@ -21,23 +27,83 @@ class GPUProcess:
         self.update_event = update_event
         self.config = config
         self.pipes = pipes
+        self.compact_transport = config["inference"].get("compact_transport", False)
         self.model = init_model(config, device, pretrained)
         self.model.eval()
         self._reset_queue()
+        self._init_telemetry()
+        self.profiler_trigger = ProfilerTrigger("gpu", config)
 
     def loop(self):
         with torch.no_grad():
             while True:
                 if self.update_event is not None:
                     self._pull_model_update()
+
+                receive_start = time.perf_counter()
+                n_queued = len(self.conns)
                 self._receive_data()
+                if len(self.conns) == n_queued:
+                    self.idle_time += time.perf_counter() - receive_start
 
                 if self._queue_is_full():
+                    forward_start = time.perf_counter()
                     policies, values = self._process_data()
+                    forward_end = time.perf_counter()
                     self._send_data(policies, values)
+                    self._log_telemetry(forward_start, forward_end)
                     self._reset_queue()
+                    # Stepped per evaluated batch, not per poll, so profiling.max_steps counts batches
+                    self.profiler_trigger.step()
+
+    def _init_telemetry(self) -> None:
+        """Per batch: batch size (and a power-of-two histogram of it), seconds each request waited in the queue
+        before the forward pass, seconds from receiving a request to sending its result, forward pass seconds,
+        the fraction of time spent polling without receiving anything, and evaluations per second.
+        Averaged over telemetry_interval batches by a StepLogger tagged "gpu". An interval of 0 disables it.
+        """
+        self.telemetry_interval = self.config["inference"].get("telemetry_interval", 0)
+        self.idle_time = 0.0
+        self.last_batch_end = time.perf_counter()
+
+        if self.telemetry_interval > 0:
+            if self.config["wandb"]["should_log"]:
+                init_wandb_run(self.config)
+            self.logger = StepLogger(
+                n=self.telemetry_interval,
+                step_name="inference batch",
+                log_wandb=self.config["wandb"]["should_log"],
+                tag="gpu",
+                sink=get_metrics_sink(self.config, "gpu"),
+            )
+
+    def _log_telemetry(self, forward_start: float, forward_end: float) -> None:
+        sent = time.perf_counter()
+        wall_time = sent - self.last_batch_end
+        batch_size = len(self.conns)
+        bucket = 1 << (batch_size - 1).bit_length()
+
+        if self.telemetry_interval > 0:
+            receive_times = np.array(self.receive_times)
+            self.logger.log(
+                {
+                    "batch_size": batch_size,
+                    f"batch_size_bucket_{bucket}": 1,
+                    "queue_latency": float(np.mean(forward_start - receive_times)),
+                    "max_queue_latency": float(np.max(forward_start - receive_times)),
+                    "service_latency": float(np.mean(sent - receive_times)),
+                    "forward_time": forward_end - forward_start,
+                    "idle_fraction": self.idle_time / wall_time,
+                    "evals_per_second": batch_size / wall_time,
+                }
+            )
+
+        self.idle_time = 0.0
+        self.last_batch_end = sent
 
     def _reset_queue(self) -> None:
+        self.receive_times = []
+        self.compact_states = []
         self.bays = []
         self.flat_ts = []
         self.containers_left = []
@@ -55,15 +121,19 @@ class GPUProcess:
         for parent_conn, _ in self.pipes:
             if not parent_conn.poll():
                 continue
-            bay, flat_T, containers_left, mask = parent_conn.recv()
-            self.bays.append(bay)
-            self.flat_ts.append(flat_T)
-            self.containers_left.append(containers_left)
-            self.masks.append(mask)
+            if self.compact_transport:
+                self.compact_states.append(parent_conn.recv())
+            else:
+                bay, flat_T, containers_left, mask = parent_conn.recv()
+                self.bays.append(bay)
+                self.flat_ts.append(flat_T)
+                self.containers_left.append(containers_left)
+                self.masks.append(mask)
             self.conns.append(parent_conn)
+            self.receive_times.append(time.perf_counter())
 
     def _queue_is_full(self) -> bool:
-        return len(self.bays) >= self.config["inference"]["batch_size"]
+        return len(self.conns) >= self.config["inference"]["batch_size"]
 
     def _process_bays(self):
         bays = np.stack(self.bays)
@@ -91,10 +161,15 @@ class GPUProcess:
         return containers_left
 
     def _process_data(self) -> None:
-        bays = self._process_bays()
-        flat_ts = self._process_flat_ts()
-        masks = self._process_masks()
-        containers_left = self._process_containers_left()
+        if self.compact_transport:
+            bays, flat_ts, containers_left, masks = decode_compact_states(
+                self.compact_states, self.config, self.device
+            )
+        else:
+            bays = self._process_bays()
+            flat_ts = self._process_flat_ts()
+            masks = self._process_masks()
+            containers_left = self._process_containers_left()
 
         with torch.no_grad():
             policies, values, _ = self.model(bays, flat_ts, containers_left, masks)
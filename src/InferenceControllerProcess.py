@@ -1,14 +1,23 @@
 import time
+import queue as queue_module
+from collections import defaultdict
 from Logging import init_wandb_run
 from StepLogger import StepLogger
+from LogHistogram import LogHistogram
+from MetricsSink import get_metrics_sink
+from ProfilerTrigger import ProfilerTrigger
 from multiprocessing import Queue
 import torch.multiprocessing as mp
-import time
 
 
 class InferenceControllerProcess:
     """Collects episode data from inference processes and logs it.
-    The episode data includes: value, reshuffles, seconds/episode and removes/episode.
+    The episode data includes: value, reshuffles, seconds/episode, removes/episode, seconds throttled by the RateLimiter
+    and, with inference.phase_timing, the seconds and calls per search phase (see PhaseTimer).
+    Episode duration and search time per move are reported as percentiles.
+    Blocks on the queue until a record arrives (or drain_timeout passes), then drains every pending record in one pass
+    and logs them per tag in a batch. The queue is bounded by inference.log_queue_size, so a slow controller blocks the
+    producers instead of growing memory. The pass sizes, queue latency and depth are logged under the "controller" tag.
     """
 
     def __init__(self, queue: Queue, config: dict, current_env_size: mp.Array):
@@ -23,27 +32,77 @@ class InferenceControllerProcess:
             init_wandb_run(self.config)
 
         self.loggers = {}
+        self.drain_timeout = config["inference"].get("controller_drain_timeout", 1.0)
+        self.max_drain = config["inference"].get("log_queue_size", 10000)
+        self.queue_logger = StepLogger(
+            n=config["inference"]["log_interval"],
+            step_name="drain",
+            log_wandb=config["wandb"]["should_log"],
+            tag="controller",
+            sink=get_metrics_sink(config, "controller"),
+        )
+        self.profiler_trigger = ProfilerTrigger("controller", config)
 
     def loop(self) -> None:
         while True:
-            if not self.queue.empty():
-                data = self.queue.get()
-                tag = data.pop("tag")
-                self.log_for_tag(data, tag)
-                self.log_for_tag(data, "all")
+            self.profiler_trigger.step()
+            records = self._drain()
+            if len(records) == 0:
+                continue
+
+            histograms = [data.pop("histograms", {}) for data in records]
+            by_tag = defaultdict(lambda: ([], []))
+            for data, data_histograms in zip(records, histograms):
+                tag_records, tag_histograms = by_tag[data.pop("tag")]
+                tag_records.append(data)
+                tag_histograms.append(data_histograms)
+
+            for tag, (tag_records, tag_histograms) in by_tag.items():
+                self.log_for_tag(tag_records, tag_histograms, tag)
+            self.log_for_tag(records, histograms, "all")
+
+            for data in records:
                 self.increment_reshuffle(data["reshuffles"])
-            else:
-                time.sleep(5)
 
-    def log_for_tag(self, data, tag):
+    def _drain(self) -> list[dict]:
+        """Waits for the first record, then takes every record already queued (at most max_drain)"""
+        try:
+            records = [self.queue.get(timeout=self.drain_timeout)]
+        except queue_module.Empty:
+            return []
+
+        while len(records) < self.max_drain:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue_module.Empty:
+                break
+
+        now = time.time()
+        latency = LogHistogram()
+        for data in records:
+            latency.add(now - data.pop("enqueued_at", now))
+        self.queue_logger.log(
+            {"drained_records": len(records), "queue_depth": self._queue_depth()},
+            {"queue_latency": latency},
+        )
+        return records
+
+    def _queue_depth(self) -> int:
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:  # macOS
+            return 0
+
+    def log_for_tag(self, records, histograms, tag):
         if tag not in self.loggers:
             self.loggers[tag] = StepLogger(
                 n=self.config["inference"]["log_interval"],
                 step_name="episode",
                 log_wandb=self.config["wandb"]["should_log"],
                 tag=tag,
+                sink=get_metrics_sink(self.config, "controller"),
             )
-        self.loggers[tag].log(data)
+        self.loggers[tag].log_batch(records, histograms)
 
     def increment_reshuffle(self, reshuffles):
         self._update_reshuffle_stats(reshuffles)
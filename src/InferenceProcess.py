@@ -1,4 +1,5 @@
 import torch
+import time
 import numpy as np
 import random
 from PaddedEnv import PaddedEnv
@@ -7,7 +8,13 @@ from Buffer import ReplayBuffer
 from multiprocessing.connection import Connection
 from multiprocessing import Queue
 from EpisodePlayer import EpisodePlayer
+from LocalEvaluator import LocalEvaluator
+from RateLimiter import RateLimiter
+from PhaseTimer import phase_timer
+from ProfilerTrigger import ProfilerTrigger
+from Train import PretrainedModel
 import torch.multiprocessing as mp
+from typing import Union
 
 
 class InferenceProcess:
@@ -15,23 +22,36 @@ class InferenceProcess:
         self,
         seed: int,
         buffer: ReplayBuffer,
-        conn: Connection,
+        conn: Union[Connection, None],
         log_episode_queue: Queue,
         config: dict,
         current_env_size: mp.Array,
+        update_event: Union[mp.Event, None] = None,
+        pretrained: Union[PretrainedModel, None] = None,
     ) -> None:
         torch.manual_seed(seed)
         np.random.seed(seed)
         self.buffer = buffer
+        self.rate_limiter = RateLimiter(buffer, config)
         self.seed = seed
+
+        if conn is None:
+            # In-process topology: evaluate leaves with a local model copy instead of GPUProcess
+            conn = LocalEvaluator(update_event, "cpu", pretrained, config)
+
         self.conn = conn
         self.log_episode_queue = log_episode_queue
+        self.queue_wait = 0.0
         self.config = config
+        phase_timer.enabled = config["inference"].get("phase_timing", False)
+        self.profiler_trigger = ProfilerTrigger("inference", config)
 
     def loop(self):
         while True:
+            self.profiler_trigger.step()
             env = self._get_env()
 
+            start = time.perf_counter()
             player = EpisodePlayer(env, self.conn, self.config, deterministic=False)
             (
                 observations,
@@ -39,18 +59,32 @@ class InferenceProcess:
                 reshuffles,
                 remove_fraction,
             ) = player.run_episode()
+            duration = time.perf_counter() - start
 
+            throttled_time = self.rate_limiter.wait_to_insert()
             self.buffer.extend(observations)
 
+            put_start = time.perf_counter()
             self.log_episode_queue.put(
                 {
                     "value": value,
                     "reshuffles": reshuffles,
                     "remove_fraction": remove_fraction,
-                    "n_observations": len(observations),
+                    "n_observations": len(observations["value"]),
+                    "throttled_time": throttled_time,
+                    # Seconds the previous put blocked on the full queue
+                    "queue_wait": self.queue_wait,
+                    "enqueued_at": time.time(),
                     "tag": f"R{env.R}C{env.C}N{env.N}",
+                    **phase_timer.pop(),
+                    **player.memory_report(),
+                    "histograms": {
+                        "episode_duration": duration,
+                        "search_time_per_move": player.search_times,
+                    },
                 }
             )
+            self.queue_wait = time.perf_counter() - put_start
             env.close()
 
     def _get_env(self) -> Env:
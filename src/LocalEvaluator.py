@@ -0,0 +1,82 @@
+from Train import init_model, PretrainedModel
+from CompactTransport import decode_compact_states
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.multiprocessing as mp
+
+
+class ModelUpdateBroadcast:
+    """Sets one update event per evaluator, so every process holding its own model copy
+    picks up the new weights (a single shared event would be cleared by the first reader).
+    """
+
+    def __init__(self, events: list) -> None:
+        self.events = events
+
+    def set(self) -> None:
+        for event in self.events:
+            event.set()
+
+
+class LocalEvaluator:
+    """Evaluates MCTS leaves inside the self-play process.
+    Implements the send/recv half of a Connection, so it can be used in place of the pipe to GPUProcess.
+    """
+
+    def __init__(
+        self,
+        update_event: mp.Event,
+        device: torch.device,
+        pretrained: PretrainedModel,
+        config: dict,
+    ) -> None:
+        torch.set_num_threads(config["inference"].get("threads_per_process", 1))
+        self.device = device
+        self.update_event = update_event
+        self.config = config
+        self.quantize = config["inference"].get("quantize", False)
+        self.float_model = init_model(config, device, pretrained)
+        self.float_model.eval()
+        self.model = self._prepare_model()
+        self.request = None
+
+    def send(self, data: tuple) -> None:
+        if self.update_event is not None:
+            self._pull_model_update()
+        self.request = data
+
+    def recv(self) -> tuple[np.ndarray, np.ndarray]:
+        if self.config["inference"].get("compact_transport", False):
+            inputs = decode_compact_states([self.request], self.config, self.device)
+        else:
+            bay, flat_T, containers_left, mask = self.request
+            inputs = (
+                torch.tensor(bay).unsqueeze(0).unsqueeze(0).to(self.device),
+                torch.tensor(flat_T).unsqueeze(0).to(self.device),
+                torch.tensor(containers_left).unsqueeze(0).to(self.device),
+                torch.tensor(mask).unsqueeze(0).to(self.device),
+            )
+        self.request = None
+
+        with torch.no_grad():
+            policy, value, _ = self.model(*inputs)
+
+        return policy[0].cpu().numpy(), value[0].cpu().numpy()
+
+    def _pull_model_update(self) -> None:
+        if self.update_event.is_set():
+            self.float_model.load_state_dict(
+                torch.load("shared_model.pt", map_location=self.device)
+            )
+            self.model = self._prepare_model()
+            self.update_event.clear()
+
+    def _prepare_model(self) -> nn.Module:
+        if not self.quantize:
+            return self.float_model
+
+        # Dynamic quantization only covers the Linear layers, the convolutions stay in float32
+        return torch.ao.quantization.quantize_dynamic(
+            self.float_model, {nn.Linear}, dtype=torch.qint8
+        )
@@ -0,0 +1,60 @@
+import math
+import numpy as np
+
+
+class LogHistogram:
+    """Streaming histogram of positive values (durations in seconds) over fixed logarithmic buckets.
+    Bucket i > 0 covers [min_value * growth^(i - 1), min_value * growth^i), so percentiles are within 2% of the true value
+    between 1 microsecond and about 11 days. Memory is constant, and merging is an addition of the bucket counts.
+    """
+
+    min_value = 1e-6
+    growth = 1.04
+    n_buckets = 706
+
+    def __init__(self) -> None:
+        self.counts = np.zeros(self.n_buckets, dtype=np.int64)
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        self.counts[self._bucket(value)] += 1
+        self.max = max(self.max, float(value))
+
+    def merge(self, other: "LogHistogram") -> None:
+        self.counts += other.counts
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        cumulative = np.cumsum(self.counts)
+        if cumulative[-1] == 0:
+            return 0.0
+
+        bucket = int(np.searchsorted(cumulative, q / 100 * cumulative[-1]))
+        if bucket == 0:
+            return self.min_value
+
+        # Geometric middle of the bucket, never above the largest value seen
+        value = self.min_value * self.growth ** (bucket - 0.5)
+        return min(value, self.max)
+
+    def summary(self, key: str) -> dict[str, float]:
+        return {
+            f"{key}_p50": self.percentile(50),
+            f"{key}_p90": self.percentile(90),
+            f"{key}_p99": self.percentile(99),
+            f"{key}_max": self.max,
+        }
+
+    def reset(self) -> None:
+        self.counts.fill(0)
+        self.max = 0.0
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+    def _bucket(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+
+        bucket = int(math.log(value / self.min_value) / math.log(self.growth)) + 1
+        return min(bucket, self.n_buckets - 1)
@@ -4,18 +4,26 @@ from MPSPEnv import Env
 from multiprocessing.connection import Connection
 from Node import Node
 from min_max import MinMaxStats
+from PhaseTimer import phase_timer
 
 
-def run_network(node: Node, conn: Connection) -> tuple[np.ndarray, np.ndarray]:
-    conn.send(
-        (
-            node.env.bay,
-            node.env.flat_T,
-            np.array([node.env.containers_left], dtype=np.float32),
-            node.env.mask,
+def run_network(
+    node: Node, conn: Connection, config: dict
+) -> tuple[np.ndarray, np.ndarray]:
+    if config["inference"].get("compact_transport", False):
+        conn.send(node.env.compact_state)
+    else:
+        conn.send(
+            (
+                node.env.bay,
+                node.env.flat_T,
+                np.array([node.env.containers_left], dtype=np.float32),
+                node.env.mask,
+            )
         )
-    )
+    start = phase_timer.start()
     probabilities, value = conn.recv()
+    phase_timer.stop("network_wait", start)
     return probabilities, value
 
 
@@ -23,11 +31,12 @@ def get_prob_and_value(
     node: Node,
     conn: Connection,
     transposition_table: dict[Env, tuple[np.ndarray, np.ndarray]],
+    config: dict,
 ) -> tuple[torch.Tensor, float]:
     if node.env in transposition_table:
         probabilities, state_value = transposition_table[node.env]
     else:
-        probabilities, state_value = run_network(node, conn)
+        probabilities, state_value = run_network(node, conn, config)
         transposition_table[node.env] = (probabilities, state_value)
 
     return (probabilities, state_value.item() - node.env.containers_placed)
@@ -44,7 +53,9 @@ def expand_node(
     config: dict,
 ) -> float:
 
-    probabilities, state_value = get_prob_and_value(node, conn, transposition_table)
+    probabilities, state_value = get_prob_and_value(
+        node, conn, transposition_table, config
+    )
     add_children(probabilities, node, config)
 
     if is_root(node):
@@ -79,10 +90,10 @@ def evaluate(
 
 
 def add_children(probabilities: np.ndarray, node: Node, config: dict) -> None:
-    for action in range(2 * node.env.R * node.env.C):
-        if not node.env.mask[action]:
-            continue
+    start = phase_timer.start()
+    mask = node.env.mask[: 2 * node.env.R * node.env.C]
 
+    for action in np.flatnonzero(mask).tolist():
         node.add_child(
             action=action,
             new_env=node.env.copy(),
@@ -90,6 +101,8 @@ def add_children(probabilities: np.ndarray, node: Node, config: dict) -> None:
             config=config,
         )
 
+    phase_timer.stop("add_children", start)
+
 
 def backup(
     node: Node, value: float, min_reward: int, found_terminal_state: bool
@@ -157,12 +170,15 @@ def alpha_zero_search(
     reused_tree: Node = None,
     transposition_table: dict[Env, tuple[np.ndarray, np.ndarray]] = {},
 ) -> tuple[torch.Tensor, Node, dict[Env, tuple[np.ndarray, np.ndarray]]]:
+    search_start = phase_timer.start()
     root_node = get_new_root_node(root_env, reused_tree, config)
 
     found_optimal_path = False
 
     for _ in range(config["mcts"]["search_iterations"]):
+        start = phase_timer.start()
         node, min_reward, found_terminal_state = find_leaf(root_node, min_max_stats)
+        phase_timer.stop("find_leaf", start)
 
         state_value = evaluate(
             node,
@@ -173,7 +189,9 @@ def alpha_zero_search(
 
         min_max_stats.update(state_value)
 
+        start = phase_timer.start()
         backup(node, state_value, min_reward, found_terminal_state)
+        phase_timer.stop("backup", start)
 
         is_optimal_path = (
             node.env.terminated and node.env.total_reward == root_node.env.total_reward
@@ -182,6 +200,7 @@ def alpha_zero_search(
             found_optimal_path = True
             break
 
+    phase_timer.stop("search", search_start)
     return (
         get_tree_probs(root_node, config),
         root_node,
@@ -0,0 +1,32 @@
+import resource
+
+
+class MemoryStats:
+    """Counts the search objects currently alive in this process, to locate memory growth in the workers.
+    live_nodes: Nodes created and not yet closed. live_envs: PaddedEnvs holding a C env (allocated by reset or copy,
+    freed by close). Both should return to their value from before an episode once the episode is cleaned up.
+    """
+
+    def __init__(self) -> None:
+        self.live_nodes = 0
+        self.live_envs = 0
+
+    def snapshot(self) -> tuple[int, int]:
+        return self.live_nodes, self.live_envs
+
+    def leaks_since(self, snapshot: tuple[int, int]) -> dict[str, float]:
+        """Nodes and envs left open since snapshot was taken, with the process totals and peak RSS"""
+        leaked_nodes = self.live_nodes - snapshot[0]
+        leaked_envs = self.live_envs - snapshot[1]
+        return {
+            "leaked_nodes": leaked_nodes,
+            "leaked_envs": leaked_envs,
+            "memory_leak": float(leaked_nodes != 0 or leaked_envs != 0),
+            "live_nodes": self.live_nodes,
+            "live_envs": self.live_envs,
+            # ru_maxrss is in kilobytes on Linux
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+
+
+memory_stats = MemoryStats()
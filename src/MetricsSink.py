@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+import wandb
+
+
+class MetricsSink:
+    """Writes metric records to a local append-only JSONL file from a background thread.
+    log only enqueues the record (and drops it if the queue is full), so callers never wait on disk or network.
+    Every flush_interval seconds the queued records are appended in one write, and optionally uploaded to wandb
+    from the same thread, along with any queued model artifacts, whose files are deleted once logged.
+    The last records are flushed at exit. multiprocessing children skip atexit, so start_process_loop
+    flushes them through flush_metrics_sink instead.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        upload_wandb: bool,
+        flush_interval: float = 5.0,
+        max_queued: int = 100000,
+    ) -> None:
+        self.path = path
+        self.upload_wandb = upload_wandb
+        self.flush_interval = flush_interval
+        self.records = queue.Queue(maxsize=max_queued)
+        self.artifacts = queue.Queue()
+        self.n_dropped = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        thread = threading.Thread(target=self._loop, daemon=True)
+        thread.start()
+        atexit.register(self.flush)
+
+    def log(self, record: dict) -> None:
+        try:
+            self.records.put_nowait({"time": time.time(), **record})
+        except queue.Full:
+            self.n_dropped += 1
+
+    def log_artifact(self, name: str, artifact_type: str, path: str) -> None:
+        """Uploads the file at path as a wandb artifact from the background thread"""
+        self.artifacts.put((name, artifact_type, path))
+
+    def flush(self) -> None:
+        with self.lock:
+            records = self._drain(self.records)
+            if self.n_dropped > 0:
+                records.append({"time": time.time(), "dropped_records": self.n_dropped})
+                self.n_dropped = 0
+
+            if len(records) > 0:
+                with open(self.path, "a") as f:
+                    f.write("".join(json.dumps(r, default=float) + "\n" for r in records))
+
+            if self.upload_wandb:
+                for record in records:
+                    wandb.log(record)
+                for name, artifact_type, path in self._drain(self.artifacts):
+                    artifact = wandb.Artifact(name=name, type=artifact_type)
+                    # add_file stages its own copy of the file
+                    artifact.add_file(path)
+                    wandb.run.log_artifact(artifact)
+                    os.remove(path)
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    @staticmethod
+    def _drain(items: queue.Queue) -> list:
+        drained = []
+        while True:
+            try:
+                drained.append(items.get_nowait())
+            except queue.Empty:
+                return drained
+
+
+_sink = None
+
+
+def get_metrics_sink(config: dict, role: str) -> MetricsSink:
+    """The MetricsSink of this process, writing to <metrics.directory>/<role>-<pid>.jsonl"""
+    global _sink
+    if _sink is None:
+        metrics = config.get("metrics", {})
+        _sink = MetricsSink(
+            path=os.path.join(
+                metrics.get("directory", "metrics"), f"{role}-{os.getpid()}.jsonl"
+            ),
+            upload_wandb=config["wandb"]["should_log"]
+            and metrics.get("upload_wandb", True),
+            flush_interval=metrics.get("flush_interval", 5.0),
+        )
+
+    return _sink
+
+
+def flush_metrics_sink() -> None:
+    """Flushes the MetricsSink of this process, if it has one"""
+    if _sink is not None:
+        _sink.flush()
@@ -179,3 +179,136 @@ class NeuralNetwork(nn.Module):
         value = self.value_head(tower2)
 
         return policy, value, logits
+
+
+class FullyConvolutionalNetwork(nn.Module):
+    """Network variant whose trunk and heads run at the actual bay size instead of the padded one.
+    The mask enters as two input planes, the policy is one add- and one remove-logit per bay position
+    and the value is predicted from globally pooled features, so no layer depends on R or C.
+    Weights therefore transfer across bay sizes, and small bays cost proportionally less compute.
+    The inputs and outputs are padded exactly as for NeuralNetwork. Batches with mixed bay sizes are
+    split into buckets of equal (R, C), which are run through the network separately.
+    """
+
+    def __init__(self, config, device):
+        super().__init__()
+        self.device = device
+        self.env_config = config["env"]
+        nn_config = config["nn"]
+        input_channels = 3
+
+        tower1 = []
+        tower1.append(
+            Convolutional_Block(
+                input_channels,
+                nn_config["hidden_channels"],
+                nn_config["hidden_kernel_size"],
+                stride=nn_config["hidden_stride"],
+            )
+        )
+        for _ in range(math.floor(nn_config["blocks"] / 2)):
+            tower1.append(
+                Residual_Block(
+                    nn_config["hidden_channels"],
+                    nn_config["hidden_channels"],
+                    nn_config["hidden_kernel_size"],
+                    nn_config["hidden_stride"],
+                )
+            )
+
+        self.tower1 = nn.Sequential(*tower1)
+
+        tower2 = []
+        for _ in range(math.ceil(nn_config["blocks"] / 2)):
+            tower2.append(
+                Residual_Block(
+                    nn_config["hidden_channels"],
+                    nn_config["hidden_channels"],
+                    nn_config["hidden_kernel_size"],
+                    nn_config["hidden_stride"],
+                )
+            )
+
+        self.tower2 = nn.Sequential(*tower2)
+
+        self.policy_head = nn.Sequential(
+            nn.Conv2d(
+                in_channels=nn_config["hidden_channels"],
+                out_channels=nn_config["policy_channels"],
+                kernel_size=nn_config["policy_kernel_size"],
+                stride=nn_config["policy_stride"],
+            ),
+            nn.SiLU(),
+            nn.BatchNorm2d(nn_config["policy_channels"]),
+            nn.Conv2d(
+                in_channels=nn_config["policy_channels"],
+                out_channels=2,  # add and remove
+                kernel_size=1,
+            ),
+        )
+        self.softmax = nn.Softmax(dim=1)
+
+        self.value_head = nn.Sequential(
+            nn.AdaptiveAvgPool2d(1),
+            nn.Flatten(),
+            nn.Linear(nn_config["hidden_channels"], nn_config["value_hidden"]),
+            nn.SiLU(),
+            nn.Linear(nn_config["value_hidden"], 1),
+        )
+        self.containers_left_embedding = nn.Sequential(
+            nn.Linear(1, nn_config["embedding_hidden_size"]),
+            nn.SiLU(),
+            nn.Linear(nn_config["embedding_hidden_size"], nn_config["hidden_channels"]),
+        )
+        self.flat_T_embedding = nn.Sequential(
+            nn.Linear(
+                self.env_config["N"] * (self.env_config["N"] - 1) // 2,
+                nn_config["embedding_hidden_size"],
+            ),
+            nn.SiLU(),
+            nn.Linear(nn_config["embedding_hidden_size"], nn_config["hidden_channels"]),
+        )
+
+    def forward(self, bay, flat_T, containers_left, mask):
+        if bay.dim() == 2:
+            bay = bay.unsqueeze(0).unsqueeze(0)
+
+        max_R = self.env_config["R"]
+        max_C = self.env_config["C"]
+        # The bay is padded with -1, while the normalized bay itself is non-negative
+        R = (bay[:, 0, :, 0] != -1).sum(dim=1)
+        C = (bay[:, 0, 0, :] != -1).sum(dim=1)
+        mask_planes = mask.view(-1, 2, max_C, max_R)
+
+        logits = torch.zeros_like(mask_planes)
+        value = torch.zeros((len(bay), 1), device=bay.device, dtype=bay.dtype)
+
+        for size in torch.unique(torch.stack([R, C], dim=1), dim=0).tolist():
+            r, c = size
+            index = torch.nonzero((R == r) & (C == c)).flatten()
+            bucket_logits, bucket_value = self._forward_bucket(
+                bay[index, :, :r, :c],
+                flat_T[index],
+                containers_left[index],
+                mask_planes[index, :, :c, :r].transpose(2, 3),
+            )
+            logits[index, :, :c, :r] = bucket_logits.transpose(2, 3)
+            value[index] = bucket_value
+
+        logits = logits.flatten(start_dim=1)
+        logits = logits - (1 - mask) * 1e9  # mask out invalid moves
+        policy = self.softmax(logits)
+
+        return policy, value, logits
+
+    def _forward_bucket(self, bay, flat_T, containers_left, mask):
+        x = torch.cat([bay, mask], dim=1)
+        tower1 = self.tower1(x)
+        containers_left_embedding = (
+            self.containers_left_embedding(containers_left).unsqueeze(-1).unsqueeze(-1)
+        )
+        flat_T_embedding = self.flat_T_embedding(flat_T).unsqueeze(-1).unsqueeze(-1)
+        tower1 = tower1 + containers_left_embedding + flat_T_embedding
+        tower2 = self.tower2(tower1)
+
+        return self.policy_head(tower2), self.value_head(tower2)
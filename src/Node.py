@@ -2,6 +2,8 @@ import numpy as np
 from MPSPEnv import Env
 import warnings
 from min_max import MinMaxStats
+from PhaseTimer import phase_timer
+from MemoryStats import memory_stats
 
 
 class Node:
@@ -26,6 +28,7 @@ class Node:
         self._Q = None
         self._U = None
         self.estimate = None
+        memory_stats.live_nodes += 1
 
     def add_noise(self) -> None:
         alpha = (
@@ -47,13 +50,16 @@ class Node:
     @property
     def env(self) -> Env:
         if self.needed_action is not None:
+            start = phase_timer.start()
             self._env.step(self.needed_action)
             self.needed_action = None
+            phase_timer.stop("env_step", start)
 
         return self._env
 
     def close(self):
         self._env.close()
+        memory_stats.live_nodes -= 1
 
     @property
     def Q(self) -> np.float16:
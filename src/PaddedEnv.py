@@ -1,6 +1,30 @@
 from MPSPEnv import Env
 from MPSPEnv.c_interface import c_lib
+from functools import lru_cache
 import numpy as np
+from MemoryStats import memory_stats
+
+
+@lru_cache(maxsize=None)
+def get_padding_maps(
+    R: int, C: int, N: int, max_R: int, max_C: int, max_N: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Index maps from the unpadded env arrays into the padded network inputs:
+    mask_index: position of each unpadded mask entry in the padded mask.
+    T_source/T_target: flat indices of the upper triangle of T and their position in the padded flat_T.
+    """
+    k, c, r = np.unravel_index(np.arange(2 * C * R), (2, C, R))
+    mask_index = np.ravel_multi_index((k, c, r), (2, max_C, max_R))
+
+    i, j = np.triu_indices(n=N, k=1)
+    T_source = np.ravel_multi_index((i, j), (N, N))
+    padded_position = np.full((max_N, max_N), -1)
+    padded_position[np.triu_indices(n=max_N, k=1)] = np.arange(
+        max_N * (max_N - 1) // 2
+    )
+    T_target = padded_position[i, j]
+
+    return mask_index, T_source, T_target
 
 
 class PaddedEnv(Env):
@@ -20,6 +44,24 @@ class PaddedEnv(Env):
         self.max_C = max_C
         self.max_R = max_R
         self.max_N = max_N
+        self.mask_index, self.T_source, self.T_target = get_padding_maps(
+            R, C, N, max_R, max_C, max_N
+        )
+        self.seed = None
+        self._clear_observation_cache()
+
+    def reset(self, seed: int = None, options=None):
+        # Kept so the episode can be replayed from its seed and actions (see ReanalyseProcess)
+        self.seed = seed
+        result = super().reset(seed, options)
+        memory_stats.live_envs += 1
+        return result
+
+    def reset_to_transportation(self, transportation: np.ndarray):
+        self.seed = None
+        result = super().reset_to_transportation(transportation)
+        memory_stats.live_envs += 1
+        return result
 
     def copy(self) -> "PaddedEnv":
         new_env = PaddedEnv(
@@ -33,10 +75,22 @@ class PaddedEnv(Env):
             self.speedy,
         )
         new_env._env = c_lib.copy_env(self._env)
+        memory_stats.live_envs += 1
         new_env._set_stores()
+        new_env.seed = self.seed
+        # The copy is in the same state, and the cached arrays are read-only, so they can be shared
+        new_env._mask = self._mask
+        new_env._bay = self._bay
+        new_env._flat_T = self._flat_T
 
         return new_env
 
+    def close(self):
+        # Env.reset and reset_to_transportation also close the previous C env through this
+        if self._env is not None:
+            memory_stats.live_envs -= 1
+        super().close()
+
     def step(self, action: int):
         col = (action // self.max_R) % self.max_C
         n_containers = action % self.max_R + 1
@@ -45,47 +99,106 @@ class PaddedEnv(Env):
             col * self.R + n_containers - 1 + (1 - is_add) * self.R * self.C
         )
         super().step(unpacked_action)
+        self._clear_observation_cache()
+
+    def _set_stores(self):
+        super()._set_stores()
+        self._clear_observation_cache()
+
+    def _clear_observation_cache(self) -> None:
+        self._mask = None
+        self._bay = None
+        self._flat_T = None
 
     @property
     def mask(self) -> np.ndarray:
-        mask = self.mask_store.ndarray.copy()
-        mask = mask.astype(np.float32)
-        mask = np.reshape(mask, (2, self.C, self.R))
-        mask = np.pad(
-            mask,
-            ((0, 0), (0, self.max_C - self.C), (0, self.max_R - self.R)),
-            "constant",
-            constant_values=0,
-        )
-        return mask.flatten()
+        if self._mask is None:
+            self._mask = self._write_mask(
+                np.empty(2 * self.max_C * self.max_R, dtype=np.float32)
+            )
+            self._mask.flags.writeable = False
+
+        return self._mask
 
     @property
     def bay(self) -> np.ndarray:
-        bay = self.bay_store.ndarray.copy()
-        bay = bay.astype(np.float32)
-
-        if self.remaining_ports > 0:
-            bay = bay / self.remaining_ports
+        if self._bay is None:
+            self._bay = self._write_bay(
+                np.empty((self.max_R, self.max_C), dtype=np.float32)
+            )
+            self._bay.flags.writeable = False
 
-        bay = np.pad(
-            bay,
-            ((0, self.max_R - self.R), (0, self.max_C - self.C)),
-            mode="constant",
-            constant_values=-1,
-        )
-        return bay
+        return self._bay
 
     @property
     def flat_T(self) -> np.ndarray:
-        T = self.T
-        T = T.astype(np.float32)
-        T = np.pad(
-            T,
-            ((0, self.max_N - self.N), (0, self.max_N - self.N)),
-            mode="constant",
-            constant_values=0,
+        if self._flat_T is None:
+            self._flat_T = self._write_flat_T(
+                np.empty(self.max_N * (self.max_N - 1) // 2, dtype=np.float32)
+            )
+            self._flat_T.flags.writeable = False
+
+        return self._flat_T
+
+    @property
+    def compact_state(self) -> tuple:
+        """Raw integer state, padded and normalized on the inference device by CompactTransport:
+        (R, C, N, remaining_ports, containers_left, uint8 bay, int16 upper triangle of T, bit-packed mask)
+        """
+        return (
+            self.R,
+            self.C,
+            self.N,
+            self.remaining_ports,
+            self.containers_left,
+            self.bay_store.ndarray.astype(np.uint8).tobytes(),
+            self.T_store.ndarray.ravel()[self.T_source].astype(np.int16).tobytes(),
+            np.packbits(self.mask_store.ndarray != 0).tobytes(),
         )
-        i, j = np.triu_indices(n=T.shape[0], k=1)
-        flat_T = T[i, j]
-        flat_T = flat_T / (self.R * self.C)
-        return flat_T
+
+    def write_observation(
+        self,
+        bay: np.ndarray,
+        flat_T: np.ndarray,
+        containers_left: np.ndarray,
+        mask: np.ndarray,
+    ) -> None:
+        """Writes the four network inputs into caller-provided float32 buffers of shape
+        (max_R, max_C), (max_N * (max_N - 1) / 2,), (1,) and (2 * max_R * max_C,)."""
+        if self._bay is None:
+            self._write_bay(bay)
+        else:
+            bay[...] = self._bay
+
+        if self._flat_T is None:
+            self._write_flat_T(flat_T)
+        else:
+            flat_T[...] = self._flat_T
+
+        if self._mask is None:
+            self._write_mask(mask)
+        else:
+            mask[...] = self._mask
+
+        containers_left[0] = self.containers_left
+
+    def _write_mask(self, out: np.ndarray) -> np.ndarray:
+        out.fill(0)
+        out[self.mask_index] = self.mask_store.ndarray
+        return out
+
+    def _write_bay(self, out: np.ndarray) -> np.ndarray:
+        out.fill(-1)
+        bay = out[: self.R, : self.C]
+        bay[...] = self.bay_store.ndarray
+
+        if self.remaining_ports > 0:
+            bay /= self.remaining_ports
+
+        return out
+
+    def _write_flat_T(self, out: np.ndarray) -> np.ndarray:
+        out.fill(0)
+        out[self.T_target] = self.T_store.ndarray.ravel()[self.T_source]
+        out[self.T_target] /= self.R * self.C
+        return out
@@ -0,0 +1,36 @@
+import time
+from collections import defaultdict
+
+
+class PhaseTimer:
+    """Accumulates the wall time spent in each phase of the search, per process.
+    Call sites wrap a phase in start/stop. When disabled, both are a single attribute check.
+    Phases can nest (env_step runs inside find_leaf and add_children, network_wait inside search).
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def start(self) -> float:
+        return time.perf_counter() if self.enabled else 0.0
+
+    def stop(self, phase: str, start: float) -> None:
+        if self.enabled:
+            self.totals[phase] += time.perf_counter() - start
+            self.counts[phase] += 1
+
+    def pop(self) -> dict[str, float]:
+        """Seconds and number of calls per phase since the last pop, as flat keys for StepLogger"""
+        aggregates = {}
+        for phase, total in self.totals.items():
+            aggregates[f"{phase}_seconds"] = total
+            aggregates[f"{phase}_calls"] = self.counts[phase]
+
+        self.totals.clear()
+        self.counts.clear()
+        return aggregates
+
+
+phase_timer = PhaseTimer()
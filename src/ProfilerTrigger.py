@@ -0,0 +1,93 @@
+import os
+import time
+import signal
+import cProfile
+import torch
+
+
+class ProfilerTrigger:
+    """Captures a bounded profile of a running process on demand, without restarting it.
+    A capture is requested by sending SIGUSR1 to the process, or by touching profiling.control_file
+    (which triggers every process once). It covers the next profiling.max_steps loop iterations or profiling.duration
+    seconds, whichever ends first, and is written to <profiling.directory>/<role>-<pid>-<unix time>.prof (cProfile)
+    or .json (torch.profiler chrome trace, with profiling.mode "torch").
+    Call step once per unit of work (a batch, an episode), not per idle poll. Between captures it only compares a timestamp.
+    """
+
+    def __init__(self, role: str, config: dict) -> None:
+        profiling = config.get("profiling", {})
+        self.role = role
+        self.mode = profiling.get("mode", "cprofile")
+        self.directory = profiling.get("directory", "profiles")
+        self.control_file = profiling.get("control_file", "profile_now")
+        self.duration = profiling.get("duration", 30)
+        self.max_steps = profiling.get("max_steps", 1000)
+        self.poll_interval = 1.0
+        self.next_poll = time.monotonic() + self.poll_interval
+        self.last_control_mtime = self._control_mtime()
+        self.requested = False
+        self.profiler = None
+
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self._request)
+
+    def step(self) -> None:
+        if self.profiler is not None:
+            self.steps += 1
+            if self.steps >= self.max_steps or time.monotonic() >= self.deadline:
+                self._stop()
+        elif self.requested or self._control_file_touched():
+            self._start()
+
+    def _request(self, signum, frame) -> None:
+        self.requested = True
+
+    def _control_file_touched(self) -> bool:
+        now = time.monotonic()
+        if now < self.next_poll:
+            return False
+
+        self.next_poll = now + self.poll_interval
+        mtime = self._control_mtime()
+        touched = mtime > self.last_control_mtime
+        self.last_control_mtime = mtime
+        return touched
+
+    def _control_mtime(self) -> float:
+        try:
+            return os.path.getmtime(self.control_file)
+        except OSError:
+            return 0.0
+
+    def _start(self) -> None:
+        self.requested = False
+        self.steps = 0
+        self.deadline = time.monotonic() + self.duration
+
+        if self.mode == "torch":
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.profiler = torch.profiler.profile(activities=activities)
+            self.profiler.start()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def _stop(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(
+            self.directory, f"{self.role}-{os.getpid()}-{int(time.time())}"
+        )
+
+        if self.mode == "torch":
+            self.profiler.stop()
+            self.profiler.export_chrome_trace(path + ".json")
+            path += ".json"
+        else:
+            self.profiler.disable()
+            self.profiler.dump_stats(path + ".prof")
+            path += ".prof"
+
+        self.profiler = None
+        print(f"Wrote profile of {self.steps} steps to {path}")
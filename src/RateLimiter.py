@@ -0,0 +1,54 @@
+import time
+
+
+class RateLimiter:
+    """Keeps the number of sampled rows close to samples_per_insert times the number of inserted rows.
+    Uses the shared n_written and n_sampled counters of the ReplayBuffer, so every process builds its own RateLimiter.
+    Rows restored from a checkpoint are not counted as inserted.
+    With diff = samples_per_insert * n_inserted - n_sampled, the trainer waits while sampling a batch would push diff
+    below -tolerance, and the actors wait while diff is above tolerance. A tolerance of at least batch_size
+    guarantees that one of the two sides can always proceed.
+    A samples_per_insert of 0 disables the limiter.
+    """
+
+    def __init__(self, buffer, config: dict) -> None:
+        self.buffer = buffer
+        self.samples_per_insert = config["train"].get("samples_per_insert", 0)
+        self.tolerance = config["train"].get(
+            "samples_per_insert_tolerance", 10 * config["train"]["batch_size"]
+        )
+        self.poll_interval = 0.01
+        assert (
+            self.samples_per_insert == 0
+            or self.tolerance >= config["train"]["batch_size"]
+        ), "samples_per_insert_tolerance must be at least batch_size, or training and self-play can block each other"
+
+    def wait_to_sample(self, batch_size: int) -> float:
+        """Blocks until batch_size rows may be sampled, and counts them as sampled. Returns the seconds spent waiting."""
+        start = time.time()
+
+        if self.samples_per_insert > 0:
+            while self._diff() - batch_size < -self.tolerance:
+                time.sleep(self.poll_interval)
+
+        with self.buffer.n_sampled.get_lock():
+            self.buffer.n_sampled.value += batch_size
+
+        return time.time() - start
+
+    def wait_to_insert(self) -> float:
+        """Blocks until the actors may insert more rows. Returns the seconds spent waiting."""
+        start = time.time()
+
+        if self.samples_per_insert > 0:
+            while self._diff() > self.tolerance:
+                time.sleep(self.poll_interval)
+
+        return time.time() - start
+
+    def _diff(self) -> float:
+        return (
+            self.samples_per_insert
+            * (self.buffer.n_written.value - self.buffer.n_written_at_start)
+            - self.buffer.n_sampled.value
+        )
@@ -0,0 +1,115 @@
+import time
+import torch
+import numpy as np
+from PaddedEnv import PaddedEnv
+from Buffer import ReplayBuffer
+from multiprocessing.connection import Connection
+from LocalEvaluator import LocalEvaluator
+from MCTS import alpha_zero_search, close_envs_in_tree
+from min_max import MinMaxStats
+from Logging import init_wandb_run
+from StepLogger import StepLogger
+from MetricsSink import get_metrics_sink
+from ProfilerTrigger import ProfilerTrigger
+from Train import PretrainedModel
+import torch.multiprocessing as mp
+from typing import Union
+
+
+class ReanalyseProcess:
+    """Refreshes the policy targets of stored rows with the latest model.
+    Picks a random row, rebuilds its env state by resetting to the episode seed and replaying the recorded actions,
+    and overwrites the row's prob with the result of a (possibly shorter) search.
+    Evaluates leaves through the same GPUProcess or local model as the InferenceProcesses.
+    """
+
+    def __init__(
+        self,
+        seed: int,
+        buffer: ReplayBuffer,
+        conn: Union[Connection, None],
+        config: dict,
+        update_event: Union[mp.Event, None] = None,
+        pretrained: Union[PretrainedModel, None] = None,
+    ) -> None:
+        torch.manual_seed(seed)
+        np.random.seed(seed)
+        self.buffer = buffer
+
+        if conn is None:
+            conn = LocalEvaluator(update_event, "cpu", pretrained, config)
+
+        self.conn = conn
+        self.config = config
+        self.search_config = {
+            **config,
+            "mcts": {
+                **config["mcts"],
+                "search_iterations": config["reanalyse"].get(
+                    "search_iterations", config["mcts"]["search_iterations"]
+                ),
+            },
+        }
+
+        if config["wandb"]["should_log"]:
+            init_wandb_run(config)
+
+        self.logger = StepLogger(
+            n=config["reanalyse"].get("log_interval", 1000),
+            step_name="reanalysed row",
+            log_wandb=config["wandb"]["should_log"],
+            tag="reanalyse",
+            sink=get_metrics_sink(config, "reanalyse"),
+        )
+        self.profiler_trigger = ProfilerTrigger("reanalyse", config)
+
+    def loop(self) -> None:
+        while True:
+            self.profiler_trigger.step()
+            target = self.buffer.sample_for_reanalyse()
+            if target is None:
+                if len(self.buffer) == 0:
+                    time.sleep(1)
+                continue
+            if min(target["env_size"]) <= 0:  # A corrupt episode record, skipped rather than crashing the worker
+                continue
+
+            start = time.time()
+            prob = self._search(target)
+            updated = self.buffer.update_prob(
+                target["index"], target["episode_id"], prob
+            )
+            self.logger.log(
+                {"updated": float(updated), "search_time": time.time() - start}
+            )
+
+    def _search(self, target: dict) -> torch.Tensor:
+        env = self._rebuild_env(target)
+        try:
+            probabilities, tree, _, _ = alpha_zero_search(
+                env, self.conn, self.search_config, MinMaxStats(), None, {}
+            )
+            close_envs_in_tree(tree)
+        finally:
+            env.close()
+
+        return probabilities
+
+    def _rebuild_env(self, target: dict) -> PaddedEnv:
+        R, C, N = target["env_size"]
+        env = PaddedEnv(
+            R=R,
+            C=C,
+            N=N,
+            max_R=self.config["env"]["R"],
+            max_C=self.config["env"]["C"],
+            max_N=self.config["env"]["N"],
+            auto_move=True,
+            speedy=True,
+        )
+        env.reset(target["seed"])
+
+        for action in target["actions"]:
+            env.step(action)
+
+        return env
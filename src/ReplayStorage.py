@@ -0,0 +1,176 @@
+import torch
+
+
+FIELDS = ("bay", "flat_T", "prob", "value", "containers_left", "mask")
+
+
+class Float32Storage:
+    """Stores the observation fields of the replay buffer as the float32 tensors fed to the network."""
+
+    def __init__(self, config: dict) -> None:
+        self.R = config["env"]["R"]
+        self.C = config["env"]["C"]
+        self.N = config["env"]["N"]
+
+    def field_specs(self, max_size: int) -> dict[str, tuple[tuple, torch.dtype]]:
+        return {
+            "bay": ((max_size, 1, self.R, self.C), torch.float32),
+            "flat_T": ((max_size, self.N * (self.N - 1) // 2), torch.float32),
+            "prob": ((max_size, 2 * self.R * self.C), torch.float32),
+            "value": ((max_size, 1), torch.float32),
+            "containers_left": ((max_size, 1), torch.float32),
+            "mask": ((max_size, 2 * self.R * self.C), torch.float32),
+        }
+
+    def row_shapes(self) -> dict[str, tuple]:
+        """Shape of a single decoded row of every field in FIELDS"""
+        return {
+            name: shape[1:]
+            for name, (shape, _) in Float32Storage.field_specs(self, 0).items()
+        }
+
+    def encode(self, rows: dict[str, torch.Tensor]) -> dict[str, torch.Tensor]:
+        return rows
+
+    def decode(self, rows: dict[str, torch.Tensor]) -> dict[str, torch.Tensor]:
+        return rows
+
+    def encode_prob(self, prob: torch.Tensor) -> dict[str, torch.Tensor]:
+        """Encodes only the prob field, for overwriting the policy targets of stored rows"""
+        return {"prob": prob}
+
+
+class CompactStorage(Float32Storage):
+    """Stores the observation fields in a quantized layout that decodes back to float32 with vectorized tensor ops:
+    bay: int8 port numbers with the number of remaining ports they were divided by as scale (-1 for padding).
+    flat_T: container counts as uint8 (int16 for bays above 255 slots) with R * C as scale.
+    prob: the prob_top_k largest probabilities as float16 with int16 indices, renormalized to sum to one,
+        or all of them as float16 if prob_top_k is 0.
+    mask: bit-packed.
+    The scales are recovered as the smallest denominator that makes a row integral, so bay and flat_T round trip exactly.
+    A row at 12x12x16 takes 440 bytes with prob_top_k = 32 instead of 3368 bytes as float32.
+    """
+
+    def __init__(self, config: dict) -> None:
+        super().__init__(config)
+        self.prob_top_k = config["replay_buffer"].get("prob_top_k", 32)
+        self.n_actions = 2 * self.R * self.C
+        self.count_dtype = torch.uint8 if self.R * self.C <= 255 else torch.int16
+        self.shifts = torch.arange(7, -1, -1, dtype=torch.uint8)
+
+    def field_specs(self, max_size: int) -> dict[str, tuple[tuple, torch.dtype]]:
+        specs = {
+            "bay": ((max_size, 1, self.R, self.C), torch.int8),
+            "bay_scale": ((max_size, 1), torch.int16),
+            "flat_T": ((max_size, self.N * (self.N - 1) // 2), self.count_dtype),
+            "flat_T_scale": ((max_size, 1), torch.int16),
+            "value": ((max_size, 1), torch.float32),
+            "containers_left": ((max_size, 1), torch.float32),
+            "mask": ((max_size, (self.n_actions + 7) // 8), torch.uint8),
+        }
+
+        if self.prob_top_k > 0:
+            specs["prob"] = ((max_size, self.prob_top_k), torch.float16)
+            specs["prob_index"] = ((max_size, self.prob_top_k), torch.int16)
+        else:
+            specs["prob"] = ((max_size, self.n_actions), torch.float16)
+
+        return specs
+
+    def encode(self, rows: dict[str, torch.Tensor]) -> dict[str, torch.Tensor]:
+        bay = rows["bay"].flatten(start_dim=1).double()
+        is_padding = bay == -1
+        bay_scale = self._find_denominators(bay, ~is_padding, self.N)
+        bay = torch.where(is_padding, -1, (bay * bay_scale[:, None]).round())
+
+        flat_T = rows["flat_T"].double()
+        flat_T_scale = self._find_denominators(
+            flat_T, torch.ones_like(flat_T, dtype=torch.bool), self.R * self.C
+        )
+        flat_T = (flat_T * flat_T_scale[:, None]).round()
+
+        encoded = {
+            "bay": bay.to(torch.int8).view(rows["bay"].shape),
+            "bay_scale": bay_scale.to(torch.int16).unsqueeze(1),
+            "flat_T": flat_T.to(self.count_dtype),
+            "flat_T_scale": flat_T_scale.to(torch.int16).unsqueeze(1),
+            "value": rows["value"],
+            "containers_left": rows["containers_left"],
+            "mask": self._pack_bits(rows["mask"]),
+        }
+        encoded.update(self.encode_prob(rows["prob"]))
+        return encoded
+
+    def decode(self, rows: dict[str, torch.Tensor]) -> dict[str, torch.Tensor]:
+        bay = rows["bay"].float()
+        bay = torch.where(
+            bay == -1, bay, bay / rows["bay_scale"].float().view(-1, 1, 1, 1)
+        )
+        flat_T = rows["flat_T"].float() / rows["flat_T_scale"].float()
+
+        if self.prob_top_k > 0:
+            prob = torch.zeros(
+                (len(rows["prob"]), self.n_actions), device=rows["prob"].device
+            )
+            # scatter_add_, as rows with fewer non-zero entries than prob_top_k repeat indices with value 0
+            prob.scatter_add_(1, rows["prob_index"].long(), rows["prob"].float())
+        else:
+            prob = rows["prob"].float()
+
+        return {
+            "bay": bay,
+            "flat_T": flat_T,
+            "prob": prob,
+            "value": rows["value"],
+            "containers_left": rows["containers_left"],
+            "mask": self._unpack_bits(rows["mask"]),
+        }
+
+    def encode_prob(self, prob: torch.Tensor) -> dict[str, torch.Tensor]:
+        if self.prob_top_k == 0:
+            return {"prob": prob.to(torch.float16)}
+
+        values, indices = prob.topk(self.prob_top_k, dim=1)
+        total = values.sum(dim=1, keepdim=True)
+        values = torch.where(total > 0, values / total, values)
+        return {"prob": values.to(torch.float16), "prob_index": indices.to(torch.int16)}
+
+    def _pack_bits(self, mask: torch.Tensor) -> torch.Tensor:
+        n_bytes = (self.n_actions + 7) // 8
+        bits = torch.zeros((len(mask), n_bytes * 8), dtype=torch.uint8)
+        bits[:, : self.n_actions] = mask != 0
+        bits = bits.view(-1, n_bytes, 8) << self.shifts
+        return bits.sum(dim=2, dtype=torch.uint8)
+
+    def _unpack_bits(self, packed: torch.Tensor) -> torch.Tensor:
+        bits = (packed.unsqueeze(2) >> self.shifts.to(packed.device)) & 1
+        return bits.flatten(start_dim=1)[:, : self.n_actions].float()
+
+    @staticmethod
+    def _find_denominators(
+        values: torch.Tensor, is_used: torch.Tensor, max_denominator: int
+    ) -> torch.Tensor:
+        """Smallest d <= max_denominator per row for which all used values * d are integers.
+        Rows without one (not expected for env observations) fall back to max_denominator, which rounds them.
+        """
+        denominators = torch.full((len(values),), max_denominator, dtype=torch.int64)
+        unresolved = torch.arange(len(values))
+
+        for denominator in range(1, max_denominator + 1):
+            scaled = values[unresolved] * denominator
+            is_integer = ((scaled - scaled.round()).abs() < 1e-3) | ~is_used[unresolved]
+            resolved = is_integer.all(dim=1)
+            denominators[unresolved[resolved]] = denominator
+            unresolved = unresolved[~resolved]
+
+            if len(unresolved) == 0:
+                break
+
+        return denominators
+
+
+def get_storage(config: dict) -> Float32Storage:
+    if config["replay_buffer"].get("storage", "float32") == "compact":
+        return CompactStorage(config)
+    else:
+        return Float32Storage(config)
@@ -1,25 +1,55 @@
 from collections import defaultdict
+from LogHistogram import LogHistogram
 import wandb
 import time
 
 
 class StepLogger:
-    def __init__(self, n, step_name, log_wandb, tag=None):
+    def __init__(self, n, step_name, log_wandb, tag=None, sink=None):
         self.step_name = step_name
+        self.sink = sink
         self.n = n
         self.count = 0
         self.log_wandb = log_wandb
         self.tag = tag
         self.sum_dict = defaultdict(float)
+        self.histograms = defaultdict(LogHistogram)
         self.start_time = time.time()
 
-    def log(self, data: dict) -> None:
+    def log(self, data: dict, histograms: dict = {}) -> None:
+        """data is averaged over n steps. histograms maps keys to single values or LogHistograms (merged),
+        which are reported as p50/p90/p99/max over the n steps."""
         self._increment_with(data)
+        self._add_histograms(histograms)
 
         if self._should_log():
             self._log_avg()
             self._reset()
 
+    def log_batch(self, data: list[dict], histograms: list[dict]) -> None:
+        """Same as calling log for each pair of data[i] and histograms[i], summing all records up to the next
+        log interval at once."""
+        i = 0
+        while i < len(data):
+            chunk = slice(i, i + self.n - self.count % self.n)
+            for key in set().union(*data[chunk]):
+                self.sum_dict[key] += sum(record.get(key, 0) for record in data[chunk])
+            for record_histograms in histograms[chunk]:
+                self._add_histograms(record_histograms)
+            self.count += len(data[chunk])
+            i = chunk.stop
+
+            if self._should_log():
+                self._log_avg()
+                self._reset()
+
+    def _add_histograms(self, histograms: dict) -> None:
+        for key, value in histograms.items():
+            if isinstance(value, LogHistogram):
+                self.histograms[key].merge(value)
+            else:
+                self.histograms[key].add(value)
+
     def _increment_with(self, data):
         for key, value in data.items():
             self.sum_dict[key] += value
@@ -34,6 +64,10 @@ class StepLogger:
             (f"{self.tag}-{key}" if self.tag else key): value / self.n
             for key, value in self.sum_dict.items()
         }
+        for key, histogram in self.histograms.items():
+            avg_dict.update(
+                histogram.summary(f"{self.tag}-{key}" if self.tag else key)
+            )
         avg_dict[self.step_name] = self.count
         label = (
             f"{self.tag}-{self.step_name} per hour"
@@ -43,11 +77,15 @@ class StepLogger:
         value = self.n / (time.time() - self.start_time) * 3600
         avg_dict[label] = value
 
-        if self.log_wandb:
+        if self.sink is not None:
+            self.sink.log(avg_dict)
+        elif self.log_wandb:
             wandb.log(avg_dict)
         else:
             print(avg_dict)
 
     def _reset(self):
         self.sum_dict.clear()
+        for histogram in self.histograms.values():
+            histogram.reset()
         self.start_time = time.time()
@@ -0,0 +1,53 @@
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+
+class SumTree:
+    """Array-based sum-tree over the priorities of the replay buffer rows, in shared memory.
+    Node i has children 2i and 2i + 1, the root is node 1 and the leaves start at node capacity,
+    which is max_size rounded up to a power of two. Sampling and updating a batch are vectorized over the batch
+    and walk the tree one level at a time, so both cost O(batch_size * log(max_size)).
+    Callers are responsible for locking.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.capacity = 1 << (max_size - 1).bit_length()
+        self.depth = self.capacity.bit_length() - 1
+        self.tree = torch.zeros(2 * self.capacity, dtype=torch.float64).share_memory_()
+        self.max_priority = mp.Value("d", 1.0)
+
+    @property
+    def total(self) -> float:
+        return self.tree[1].item()
+
+    def get(self, indices: np.ndarray) -> np.ndarray:
+        return self.tree.numpy()[indices + self.capacity]
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray) -> None:
+        tree = self.tree.numpy()
+        nodes = indices + self.capacity
+        tree[nodes] = priorities
+
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            tree[nodes] = tree[2 * nodes] + tree[2 * nodes + 1]
+
+        self.max_priority.value = max(self.max_priority.value, np.max(priorities))
+
+    def sample(self, batch_size: int) -> np.ndarray:
+        """Draws indices proportionally to their priority, stratified over batch_size equal segments of the total"""
+        tree = self.tree.numpy()
+        total = tree[1]
+        segment = total / batch_size
+        values = (np.arange(batch_size) + np.random.rand(batch_size)) * segment
+        values = np.minimum(values, np.nextafter(total, 0))
+        nodes = np.ones(batch_size, dtype=np.int64)
+
+        for _ in range(self.depth):
+            left = 2 * nodes
+            go_right = values >= tree[left]
+            values = np.where(go_right, values - tree[left], values)
+            nodes = np.where(go_right, left + 1, left)
+
+        return nodes - self.capacity
@@ -1,9 +1,9 @@
 import torch
 import torch.optim as optim
 import wandb
-from NeuralNetwork import NeuralNetwork
+from NeuralNetwork import NeuralNetwork, FullyConvolutionalNetwork
 from ExponentialLRWithMinLR import ExponentialLRWithMinLR
-from typing import TypedDict
+from typing import TypedDict, Union
 import os
 
 
@@ -12,16 +12,20 @@ class PretrainedModel(TypedDict):
     Example:
     wandb_run: "alphastowage/AlphaStowage/camwudzo"
     wandb_model: "model20000.pt"
+    checkpoint: a full training checkpoint written by TrainingCheckpointer, which takes precedence over the others
     """
 
     wandb_run: str = None
     wandb_model: str = None
     artifact: str = None
     local_model: str = None
+    checkpoint: str = None
 
 
 nn_cross_entropy = torch.nn.CrossEntropyLoss()
 nn_mse = torch.nn.MSELoss()
+nn_cross_entropy_per_sample = torch.nn.CrossEntropyLoss(reduction="none")
+nn_mse_per_sample = torch.nn.MSELoss(reduction="none")
 
 
 def loss_fn(
@@ -30,11 +34,30 @@ def loss_fn(
     pred_logits,
     prob,
     config,
+    weights=None,
 ):
-    value_error = nn_mse(pred_value, value)
-    cross_entropy = nn_cross_entropy(pred_logits, prob)
-    loss = config["train"]["value_scaling"] * value_error + cross_entropy
-    return loss, value_error, cross_entropy
+    if weights is None:
+        value_error = nn_mse(pred_value, value)
+        cross_entropy = nn_cross_entropy(pred_logits, prob)
+        loss = config["train"]["value_scaling"] * value_error + cross_entropy
+        return loss, value_error, cross_entropy
+
+    # Importance-sampling weighted losses for prioritized replay
+    value_errors = nn_mse_per_sample(pred_value, value).mean(dim=1)
+    cross_entropies = nn_cross_entropy_per_sample(pred_logits, prob)
+    losses = config["train"]["value_scaling"] * value_errors + cross_entropies
+    loss = (weights * losses).mean()
+    return loss, value_errors.mean(), cross_entropies.mean()
+
+
+def get_priorities(pred_value, value, pred_logits, prob, config):
+    """Per-sample errors used as replay priorities"""
+    with torch.no_grad():
+        metric = config["replay_buffer"].get("priority_metric", "cross_entropy")
+        if metric == "value_error":
+            return nn_mse_per_sample(pred_value, value).mean(dim=1)
+        else:
+            return nn_cross_entropy_per_sample(pred_logits, prob)
 
 
 def optimize_model(
@@ -46,6 +69,7 @@ def optimize_model(
     optimizer,
     scheduler,
     config,
+    weights=None,
 ):
     loss, value_loss, cross_entropy = loss_fn(
         pred_value=pred_value,
@@ -53,6 +77,7 @@ def optimize_model(
         pred_logits=pred_logits,
         prob=prob,
         config=config,
+        weights=weights,
     )
     optimizer.zero_grad()
     loss.backward()
@@ -66,15 +91,27 @@ def optimize_model(
 
 
 def train_batch(model, buffer, optimizer, scheduler, config):
-    bay, flat_T, prob, value, containers_left, mask = buffer.sample(
-        config["train"]["batch_size"]
-    )
-    bay = bay.to(model.device)
-    flat_T = flat_T.to(model.device)
-    prob = prob.to(model.device)
-    value = value.to(model.device)
-    containers_left = containers_left.to(model.device)
-    mask = mask.to(model.device)
+    # Read from the parameters, as a DistributedDataParallel wrapper has no device attribute
+    device = next(model.parameters()).device
+    prioritized = config["replay_buffer"].get("prioritized", False)
+
+    if prioritized:
+        bay, flat_T, prob, value, containers_left, mask, indices, weights = (
+            buffer.sample_prioritized(config["train"]["batch_size"])
+        )
+        weights = weights.to(device, non_blocking=True)
+    else:
+        bay, flat_T, prob, value, containers_left, mask = buffer.sample(
+            config["train"]["batch_size"]
+        )
+        weights = None
+
+    bay = bay.to(device, non_blocking=True)
+    flat_T = flat_T.to(device, non_blocking=True)
+    prob = prob.to(device, non_blocking=True)
+    value = value.to(device, non_blocking=True)
+    containers_left = containers_left.to(device, non_blocking=True)
+    mask = mask.to(device, non_blocking=True)
 
     _, pred_value, pred_logits = model(bay, flat_T, containers_left, mask)
 
@@ -87,8 +124,14 @@ def train_batch(model, buffer, optimizer, scheduler, config):
         optimizer=optimizer,
         scheduler=scheduler,
         config=config,
+        weights=weights,
     )
 
+    if prioritized:
+        buffer.update_priorities(
+            indices, get_priorities(pred_value, value, pred_logits, prob, config)
+        )
+
     return (loss, value_loss, cross_entropy)
 
 
@@ -119,14 +162,38 @@ def get_model_weights_path(pretrained: PretrainedModel):
         return pretrained["wandb_model"]
 
 
+def download_pretrained(pretrained: PretrainedModel) -> PretrainedModel:
+    """Downloads the pretrained weights once and points local_model at them, so the processes started afterwards
+    all load the same file instead of each downloading (and overwriting) it"""
+    if pretrained.get("checkpoint") or pretrained["local_model"]:
+        return pretrained
+    if not (
+        pretrained["wandb_run"] and (pretrained["wandb_model"] or pretrained["artifact"])
+    ):
+        return pretrained
+
+    return PretrainedModel(
+        **{**pretrained, "local_model": get_model_weights_path(pretrained)}
+    )
+
+
 def init_model(
     config: dict, device: torch.device, pretrained: PretrainedModel
-) -> NeuralNetwork:
-    model = NeuralNetwork(config, device).to(device)
+) -> Union[NeuralNetwork, FullyConvolutionalNetwork]:
+    if config["nn"].get("architecture", "padded") == "fully_convolutional":
+        model = FullyConvolutionalNetwork(config, device).to(device)
+    else:
+        model = NeuralNetwork(config, device).to(device)
 
     print("Model initialized")
 
-    if (
+    if pretrained.get("checkpoint"):
+        print("Loading model weights from checkpoint...")
+        checkpoint = torch.load(
+            pretrained["checkpoint"], map_location=device, weights_only=False
+        )
+        model.load_state_dict(checkpoint["model"])
+    elif (
         pretrained["wandb_run"]
         and (pretrained["wandb_model"] or pretrained["artifact"])
         or pretrained["local_model"]
@@ -0,0 +1,104 @@
+import os
+import glob
+import queue
+import random
+import threading
+import numpy as np
+import torch
+from typing import Union
+
+
+class TrainingCheckpointer:
+    """Saves the full training state (model, optimizer, scheduler, batch counter and RNG state) on a background thread.
+    save takes a CPU snapshot, so training can continue while the snapshot is written.
+    Files are written to a temporary path and renamed, and only the newest keep_checkpoints are kept.
+    """
+
+    def __init__(self, config: dict) -> None:
+        self.directory = config["train"].get("checkpoint_dir", "training_checkpoints")
+        self.keep_checkpoints = config["train"].get("keep_checkpoints", 3)
+        # Holds at most one pending snapshot, so save blocks if the writer falls behind
+        self.snapshots = queue.Queue(maxsize=1)
+        os.makedirs(self.directory, exist_ok=True)
+        thread = threading.Thread(target=self._loop, daemon=True)
+        thread.start()
+
+    def save(
+        self,
+        model: torch.nn.Module,
+        optimizer: torch.optim.Optimizer,
+        scheduler,
+        batch: int,
+    ) -> None:
+        snapshot = {
+            "model": _to_cpu(model.state_dict()),
+            "optimizer": _to_cpu(optimizer.state_dict()),
+            "scheduler": scheduler.state_dict(),
+            "batch": batch,
+            "rng": {
+                "torch": torch.get_rng_state(),
+                "cuda": (
+                    torch.cuda.get_rng_state_all()
+                    if torch.cuda.is_available()
+                    else None
+                ),
+                "numpy": np.random.get_state(),
+                "python": random.getstate(),
+            },
+        }
+        self.snapshots.put(snapshot)
+
+    @staticmethod
+    def restore(
+        checkpoint: dict,
+        optimizer: torch.optim.Optimizer,
+        scheduler,
+        restore_rng: bool,
+    ) -> int:
+        """Restores the optimizer, scheduler and (optionally) RNG state. Returns the batch counter."""
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        scheduler.load_state_dict(checkpoint["scheduler"])
+
+        if restore_rng:
+            torch.set_rng_state(checkpoint["rng"]["torch"])
+            if checkpoint["rng"]["cuda"] is not None and torch.cuda.is_available():
+                torch.cuda.set_rng_state_all(checkpoint["rng"]["cuda"])
+            np.random.set_state(checkpoint["rng"]["numpy"])
+            random.setstate(checkpoint["rng"]["python"])
+
+        return checkpoint["batch"]
+
+    @staticmethod
+    def latest(directory: str) -> Union[str, None]:
+        paths = TrainingCheckpointer._checkpoint_paths(directory)
+        return paths[-1] if len(paths) > 0 else None
+
+    def _loop(self) -> None:
+        while True:
+            snapshot = self.snapshots.get()
+            path = os.path.join(self.directory, f"checkpoint{snapshot['batch']:09d}.pt")
+            temporary_path = path + ".tmp"
+            torch.save(snapshot, temporary_path)
+            os.replace(temporary_path, path)
+            self._rotate()
+
+    def _rotate(self) -> None:
+        paths = self._checkpoint_paths(self.directory)
+        for path in paths[: -self.keep_checkpoints]:
+            os.remove(path)
+
+    @staticmethod
+    def _checkpoint_paths(directory: str) -> list[str]:
+        # The zero-padded batch counter makes the names sort by age
+        return sorted(glob.glob(os.path.join(directory, "checkpoint*.pt")))
+
+
+def _to_cpu(state):
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: _to_cpu(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_to_cpu(value) for value in state)
+
+    return state
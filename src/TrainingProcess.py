@@ -8,10 +8,20 @@ from Train import (
 import torch
 from Buffer import ReplayBuffer
 import torch.multiprocessing as mp
-import wandb
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 from Logging import init_wandb_run
 from StepLogger import StepLogger
+from MetricsSink import get_metrics_sink
+from BatchPrefetcher import BatchPrefetcher
+from DeviceReplayMirror import DeviceReplayMirror
+from RateLimiter import RateLimiter
+from TrainingCheckpointer import TrainingCheckpointer
+from ProfilerTrigger import ProfilerTrigger
 import time
+import os
+import shutil
+import numpy as np
 
 
 class TrainingProcess:
@@ -22,72 +32,170 @@ class TrainingProcess:
         device: torch.device,
         pretrained: PretrainedModel,
         config: dict,
+        rank: int = 0,
     ) -> None:
-        if config["wandb"]["should_log"]:
+        """With train.n_ranks > 1, one TrainingProcess runs per rank, and the ranks train one model data-parallel
+        (each samples its own batch_size rows, gradients are averaged with gloo). Only rank 0 logs and publishes weights.
+        """
+        self.rank = rank
+        self.n_ranks = config["train"].get("n_ranks", 1)
+        self.is_main_rank = rank == 0
+
+        if config["wandb"]["should_log"] and self.is_main_rank:
             init_wandb_run(config)
 
         self.device = device
         self.buffer = buffer
+        self.batch_source = buffer
+        self.rate_limiter = RateLimiter(buffer, config)
         self.gpu_update_event = gpu_update_event
         self.config = config
         self.logger = StepLogger(
             n=self.config["train"]["log_interval"],
             step_name="batch",
             log_wandb=self.config["wandb"]["should_log"],
+            sink=get_metrics_sink(self.config, "training"),
         )
         self.model = init_model(config, device, pretrained)
+        if self.n_ranks > 1:
+            self._init_distributed()
         self.optimizer = get_optimizer(self.model, config)
         self.scheduler = get_scheduler(self.optimizer, config)
         self.model.train()
         self.batch = 1
+        self.checkpointer = None
+        self.profiler_trigger = ProfilerTrigger(f"training{rank}", config)
+
+        if pretrained.get("checkpoint"):
+            self._restore_checkpoint(pretrained["checkpoint"])
+        if self.is_main_rank and config["train"].get("checkpoint_interval", 0) > 0:
+            self.checkpointer = TrainingCheckpointer(config)
 
     def loop(self) -> None:
         self._wait_for_buffer()
+        self._start_prefetching()
 
         while True:
+            self.profiler_trigger.step()
             if self._should_swap():
                 self._swap()
             if self._should_log_weights():
                 self._log_weights()
+            if self._should_checkpoint():
+                self.checkpointer.save(
+                    self._unwrapped_model(), self.optimizer, self.scheduler, self.batch
+                )
 
             self._handle_batch()
             self.batch += 1
 
+    def _init_distributed(self) -> None:
+        torch.set_num_threads(self.config["train"].get("threads_per_rank", 1))
+        dist.init_process_group(
+            "gloo",
+            init_method=f"tcp://127.0.0.1:{self.config['train'].get('dist_port', 29500)}",
+            rank=self.rank,
+            world_size=self.n_ranks,
+        )
+        # Broadcasts the weights of rank 0, so all ranks start from the same model
+        self.model = DistributedDataParallel(self.model)
+
+    def _unwrapped_model(self) -> torch.nn.Module:
+        return self.model.module if self.n_ranks > 1 else self.model
+
     def _handle_batch(self) -> None:
+        start = time.perf_counter()
+        throttled_time = self.rate_limiter.wait_to_sample(
+            self.config["train"]["batch_size"]
+        )
         loss, value_loss, cross_entropy_loss = train_batch(
             self.model,
-            self.buffer,
+            self.batch_source,
             self.optimizer,
             self.scheduler,
             self.config,
         )
+        if not self.is_main_rank:
+            return
+
         self.logger.log(
             {
                 "loss": loss,
                 "value_loss": value_loss,
                 "cross_entropy_loss": cross_entropy_loss,
                 "lr": self.scheduler.current_lr(),
-            }
+                "throttled_time": throttled_time,
+                "host_to_device_bytes": self._host_to_device_bytes(),
+            },
+            histograms={"batch_time": time.perf_counter() - start},
         )
 
+    def _host_to_device_bytes(self) -> int:
+        if isinstance(self.batch_source, DeviceReplayMirror):
+            return self.batch_source.pop_transferred_bytes()
+
+        # The whole batch is decoded on the host and copied as float32
+        row_shapes = self.buffer.storage.row_shapes()
+        row_bytes = sum(4 * int(np.prod(shape)) for shape in row_shapes.values())
+        return self.config["train"]["batch_size"] * row_bytes
+
     def _log_weights(self) -> None:
-        artifact = wandb.Artifact(name=f"model{self.batch}", type="model")
-        artifact.add_file("shared_model.pt")
-        wandb.run.log_artifact(artifact)
+        # Copied, as shared_model.pt is overwritten by the next swap while the upload runs in the background
+        path = os.path.join(
+            self.config.get("metrics", {}).get("directory", "metrics"),
+            f"model{self.batch}.pt",
+        )
+        shutil.copyfile("shared_model.pt", path)
+        self.logger.sink.log_artifact(f"model{self.batch}", "model", path)
 
     def _should_swap(self) -> bool:
-        return self.batch % self.config["train"]["swap_interval"] == 0
+        return (
+            self.batch % self.config["train"]["swap_interval"] == 0
+            and self.is_main_rank
+        )
 
     def _should_log_weights(self) -> bool:
+        # The copy in _log_weights is only made if the sink uploads (and then deletes) it
         return (
             self.batch % self.config["train"]["save_interval"] == 0
-            and self.config["wandb"]["should_log"]
+            and self.logger.sink.upload_wandb
+            and self.is_main_rank
+        )
+
+    def _should_checkpoint(self) -> bool:
+        return (
+            self.checkpointer is not None
+            and self.batch % self.config["train"]["checkpoint_interval"] == 0
         )
 
+    def _restore_checkpoint(self, path: str) -> None:
+        checkpoint = torch.load(path, map_location=self.device, weights_only=False)
+        # The other ranks keep their own RNG state, so they keep sampling different batches.
+        # The snapshot is taken before its batch is trained, so training resumes with that batch.
+        self.batch = TrainingCheckpointer.restore(
+            checkpoint,
+            self.optimizer,
+            self.scheduler,
+            restore_rng=self.is_main_rank,
+        )
+        print(f"Resumed training from {path} at batch {self.batch}")
+
     def _swap(self) -> None:
-        torch.save(self.model.state_dict(), f"shared_model.pt")
+        torch.save(self._unwrapped_model().state_dict(), f"shared_model.pt")
         self.gpu_update_event.set()
 
+    def _start_prefetching(self) -> None:
+        n_batches = self.config["train"].get("prefetch_batches", 0)
+        if self.config["train"].get("device_mirror", False):
+            self.batch_source = DeviceReplayMirror(self.buffer, self.device, self.config)
+        elif n_batches > 0:
+            self.batch_source = BatchPrefetcher(
+                self.buffer,
+                self.config["train"]["batch_size"],
+                n_batches,
+                pin_memory=self.config["train"].get("pin_memory", True),
+            )
+
     def _wait_for_buffer(self):
         while len(self.buffer) == 0:
             time.sleep(1)
@@ -0,0 +1,131 @@
+from PaddedEnv import PaddedEnv
+import numpy as np
+from typing import Union
+
+
+class VectorPaddedEnv:
+    """A batch of PaddedEnvs of mixed (R, C, N) stepped together.
+    The padded observations of all envs are kept in stacked buffers (bay, flat_T, containers_left, mask),
+    which are updated in place, so they can be sent to the network without a per-env np.stack.
+    """
+
+    def __init__(
+        self,
+        sizes: list[tuple[int, int, int]],
+        max_R: int,
+        max_C: int,
+        max_N: int,
+        auto_move: bool = False,
+        speedy: bool = False,
+    ) -> None:
+        self.max_R = max_R
+        self.max_C = max_C
+        self.max_N = max_N
+        self.auto_move = auto_move
+        self.speedy = speedy
+        self.envs = [self._make_env(R, C, N) for R, C, N in sizes]
+
+        n_envs = len(self.envs)
+        self.bay = np.zeros((n_envs, 1, max_R, max_C), dtype=np.float32)
+        self.flat_T = np.zeros((n_envs, max_N * (max_N - 1) // 2), dtype=np.float32)
+        self.containers_left = np.zeros((n_envs, 1), dtype=np.float32)
+        self.mask = np.zeros((n_envs, 2 * max_R * max_C), dtype=np.float32)
+        self.terminated = np.zeros(n_envs, dtype=bool)
+
+    @classmethod
+    def from_benchmark(
+        cls, instances: list[dict], max_R: int, max_C: int, max_N: int
+    ) -> "VectorPaddedEnv":
+        """Builds the envs for instances as returned by benchmarking.get_benchmarking_data"""
+        vector_env = cls(
+            [(instance["R"], instance["C"], instance["N"]) for instance in instances],
+            max_R,
+            max_C,
+            max_N,
+        )
+        vector_env.reset_to_transportation(
+            [instance["transportation_matrix"] for instance in instances]
+        )
+        return vector_env
+
+    @property
+    def observation(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """The stacked buffers are overwritten by the next step or reset, copy them to keep them."""
+        return self.bay, self.flat_T, self.containers_left, self.mask
+
+    def reset(
+        self, seeds: Union[list[int], None] = None
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        for index, env in enumerate(self.envs):
+            env.reset(None if seeds is None else seeds[index])
+            self._update(index)
+
+        return self.observation
+
+    def reset_to_transportation(
+        self, transportations: list[np.ndarray]
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        for index, (env, transportation) in enumerate(zip(self.envs, transportations)):
+            env.reset_to_transportation(transportation)
+            self._update(index)
+
+        return self.observation
+
+    def reset_env(
+        self,
+        index: int,
+        R: int,
+        C: int,
+        N: int,
+        seed: Union[int, None] = None,
+        transportation: Union[np.ndarray, None] = None,
+    ) -> None:
+        """Replaces a single env with a new one of size (R, C, N), e.g. when its game has finished."""
+        self.envs[index].close()
+        self.envs[index] = self._make_env(R, C, N)
+
+        if transportation is None:
+            self.envs[index].reset(seed)
+        else:
+            self.envs[index].reset_to_transportation(transportation)
+
+        self._update(index)
+
+    def step(
+        self, actions: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Steps every env that is not terminated. Actions of terminated envs are ignored."""
+        for index in np.flatnonzero(~self.terminated):
+            self.envs[index].step(int(actions[index]))
+            self._update(index)
+
+        return self.observation
+
+    def close(self) -> None:
+        for env in self.envs:
+            env.close()
+
+    def __len__(self) -> int:
+        return len(self.envs)
+
+    def _make_env(self, R: int, C: int, N: int) -> PaddedEnv:
+        return PaddedEnv(
+            R,
+            C,
+            N,
+            max_C=self.max_C,
+            max_R=self.max_R,
+            max_N=self.max_N,
+            auto_move=self.auto_move,
+            speedy=self.speedy,
+        )
+
+    def _update(self, index: int) -> None:
+        env = self.envs[index]
+        env.write_observation(
+            self.bay[index, 0],
+            self.flat_T[index],
+            self.containers_left[index],
+            self.mask[index],
+        )
+        self.terminated[index] = env.terminated
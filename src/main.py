@@ -1,19 +1,32 @@
 from InferenceControllerProcess import InferenceControllerProcess
 from InferenceProcess import InferenceProcess
+from ReanalyseProcess import ReanalyseProcess
 from TrainingProcess import TrainingProcess
 from multiprocessing import Array
 from GPUProcess import GPUProcess
+from LocalEvaluator import ModelUpdateBroadcast
 from Logging import init_wandb_group
 import torch.multiprocessing as mp
-from Train import PretrainedModel
+from Train import PretrainedModel, download_pretrained
 from Buffer import ReplayBuffer
+from BufferCheckpointer import BufferCheckpointer
+from TrainingCheckpointer import TrainingCheckpointer
 import torch
 import json
+from MetricsSink import flush_metrics_sink
+from typing import Union
+import signal
+import sys
 
 
 def start_process_loop(process_class, *args, **kwargs):
-    process = process_class(*args, **kwargs)
-    process.loop()
+    # Turns terminate() into an exit, so the last metrics are still flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        process = process_class(*args, **kwargs)
+        process.loop()
+    finally:
+        flush_metrics_sink()
 
 
 def get_config(file_path):
@@ -23,30 +36,71 @@ def get_config(file_path):
     return config
 
 
-def run_processes(config: dict, pretrained: PretrainedModel):
-    buffer = ReplayBuffer(config)
+def get_devices() -> tuple[str, str]:
     n_gpus = torch.cuda.device_count()
-    training_device = "cuda:0" if n_gpus >= 1 else "mps"
-    gpu_device = "cuda:1" if n_gpus >= 2 else ("cuda:0" if n_gpus >= 1 else "mps")
-    gpu_update_event = mp.Event()
-    inference_pipes = [mp.Pipe() for _ in range(config["inference"]["n_processes"])]
-    episode_queue = mp.Queue()
-    current_env_size = mp.Array(
-        "i", [config["env"]["R"], config["env"]["C"], config["env"]["start_N"]]
+    fallback_device = "mps" if torch.backends.mps.is_available() else "cpu"
+    training_device = "cuda:0" if n_gpus >= 1 else fallback_device
+    gpu_device = (
+        "cuda:1" if n_gpus >= 2 else ("cuda:0" if n_gpus >= 1 else fallback_device)
     )
+    return training_device, gpu_device
 
+
+def get_inference_processes(
+    config: dict,
+    pretrained: PretrainedModel,
+    buffer: ReplayBuffer,
+    episode_queue: mp.Queue,
+    current_env_size: mp.Array,
+    gpu_device: str,
+) -> tuple[list[mp.Process], Union[mp.Event, ModelUpdateBroadcast]]:
+    """Builds the self-play (and reanalyse) processes for the configured topology:
+    "gpu_process": workers send leaves over pipes to a single GPUProcess.
+    "local": every worker holds its own model copy and evaluates leaves in-process.
+    """
+    n_processes = config["inference"]["n_processes"]
+    n_reanalyse = get_n_reanalyse_processes(config)
+
+    if config["inference"].get("topology", "gpu_process") == "local":
+        update_events = [mp.Event() for _ in range(n_processes + n_reanalyse)]
+        processes = [
+            mp.Process(
+                target=start_process_loop,
+                args=(
+                    InferenceProcess,
+                    seed,
+                    buffer,
+                    None,
+                    episode_queue,
+                    config,
+                    current_env_size,
+                    update_event,
+                    pretrained,
+                ),
+            )
+            for seed, update_event in enumerate(update_events[:n_processes])
+        ] + [
+            mp.Process(
+                target=start_process_loop,
+                args=(
+                    ReanalyseProcess,
+                    seed,
+                    buffer,
+                    None,
+                    config,
+                    update_event,
+                    pretrained,
+                ),
+            )
+            for seed, update_event in enumerate(
+                update_events[n_processes:], start=n_processes
+            )
+        ]
+        return processes, ModelUpdateBroadcast(update_events)
+
+    gpu_update_event = mp.Event()
+    inference_pipes = [mp.Pipe() for _ in range(n_processes + n_reanalyse)]
     processes = [
-        mp.Process(
-            target=start_process_loop,
-            args=(
-                TrainingProcess,
-                buffer,
-                gpu_update_event,
-                training_device,
-                pretrained,
-                config,
-            ),
-        ),
         mp.Process(
             target=start_process_loop,
             args=(
@@ -58,34 +112,103 @@ def run_processes(config: dict, pretrained: PretrainedModel):
                 config,
             ),
         ),
+    ] + [
         mp.Process(
             target=start_process_loop,
             args=(
-                InferenceControllerProcess,
+                InferenceProcess,
+                seed,
+                buffer,
+                conn,
                 episode_queue,
                 config,
                 current_env_size,
             ),
-        ),
+        )
+        for seed, (_, conn) in enumerate(inference_pipes[:n_processes])
     ] + [
+        mp.Process(
+            target=start_process_loop,
+            args=(ReanalyseProcess, seed, buffer, conn, config),
+        )
+        for seed, (_, conn) in enumerate(
+            inference_pipes[n_processes:], start=n_processes
+        )
+    ]
+    return processes, gpu_update_event
+
+
+def get_n_reanalyse_processes(config: dict) -> int:
+    """Number of reanalyse workers, so they make up inference_share of the processes sharing the inference capacity"""
+    reanalyse = config.get("reanalyse", {})
+    if not reanalyse.get("enabled", False):
+        return 0
+
+    share = reanalyse["inference_share"]
+    return max(1, round(config["inference"]["n_processes"] * share / (1 - share)))
+
+
+def get_resume_checkpoint(config: dict) -> Union[str, None]:
+    if not config["train"].get("resume", False):
+        return None
+
+    path = TrainingCheckpointer.latest(
+        config["train"].get("checkpoint_dir", "training_checkpoints")
+    )
+    if path is not None:
+        print(f"Resuming from {path}")
+
+    return path
+
+
+def run_processes(config: dict, pretrained: PretrainedModel):
+    pretrained = download_pretrained(pretrained)
+    buffer = ReplayBuffer(config)
+    training_device, gpu_device = get_devices()
+    episode_queue = mp.Queue(
+        maxsize=config["inference"].get("log_queue_size", 10000)
+    )
+    current_env_size = mp.Array(
+        "i", [config["env"]["R"], config["env"]["C"], config["env"]["start_N"]]
+    )
+    inference_processes, update_event = get_inference_processes(
+        config, pretrained, buffer, episode_queue, current_env_size, gpu_device
+    )
+
+    processes = [
         mp.Process(
             target=start_process_loop,
             args=(
-                InferenceProcess,
-                seed,
+                TrainingProcess,
                 buffer,
-                conn,
+                update_event,
+                training_device,
+                pretrained,
+                config,
+                rank,
+            ),
+        )
+        for rank in range(config["train"].get("n_ranks", 1))
+    ] + [
+        mp.Process(
+            target=start_process_loop,
+            args=(
+                InferenceControllerProcess,
                 episode_queue,
                 config,
                 current_env_size,
             ),
-        )
-        for seed, (_, conn) in enumerate(inference_pipes)
-    ]
+        ),
+    ] + inference_processes
 
     for process in processes:
         process.start()
 
+    if buffer.backend == "shared_memory":
+        # Runs on a thread of this process, which otherwise only waits for the others.
+        # The mmap backend persists through its files and needs no checkpoints.
+        BufferCheckpointer(buffer, config).start()
+
     for process in processes:
         process.join()
 
@@ -101,6 +224,7 @@ if __name__ == "__main__":
         wandb_model=config["wandb"]["pretrained_model"],
         artifact=config["wandb"]["artifact"],
         local_model=config["wandb"].get("local_model"),
+        checkpoint=get_resume_checkpoint(config),
     )
 
     if config["wandb"]["should_log"]:
@@ -0,0 +1,414 @@
+"""Measures the speed of each component of the self-play pipeline in isolation, on one process.
+Components: PaddedEnv step/copy/encode, MCTS with a stub evaluator, GPUProcess per batch size,
+ReplayBuffer extend/sample and train_batch. Writes the rates with machine info to a JSON file, so runs can be compared.
+
+Example: python throughput.py --config config.json --seconds 10 --output throughput.json
+"""
+
+import os
+import json
+import time
+import copy
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from datetime import datetime
+from typing import Callable
+from main import get_config
+from PaddedEnv import PaddedEnv
+from MCTS import alpha_zero_search, close_envs_in_tree
+from min_max import MinMaxStats
+from PhaseTimer import phase_timer
+from EpisodeRecorder import EpisodeRecorder
+from GPUProcess import GPUProcess
+from Buffer import ReplayBuffer
+from Train import (
+    PretrainedModel,
+    init_model,
+    get_optimizer,
+    get_scheduler,
+    train_batch,
+)
+
+COMPONENTS = ["env", "mcts", "gpu_process", "buffer", "train"]
+
+
+class StubEvaluator:
+    """Answers every leaf with a uniform policy and a value of 0, so only the search itself is measured.
+    Implements the send/recv half of a Connection, like LocalEvaluator."""
+
+    def __init__(self, config: dict) -> None:
+        n_actions = 2 * config["env"]["R"] * config["env"]["C"]
+        self.policy = np.full(n_actions, 1 / n_actions, dtype=np.float32)
+        self.value = np.zeros(1, dtype=np.float32)
+        self.n_evaluations = 0
+
+    def send(self, data: tuple) -> None:
+        self.n_evaluations += 1
+
+    def recv(self) -> tuple[np.ndarray, np.ndarray]:
+        return self.policy, self.value
+
+
+def measure(run: Callable[[], dict], seconds: float) -> dict[str, float]:
+    """Calls run (after one warm-up call) until seconds have passed.
+    run returns the units of work it did, e.g. {"steps": 100}, which are reported per second."""
+    run()
+    totals = {}
+    start = time.perf_counter()
+    elapsed = 0.0
+
+    while elapsed < seconds:
+        for unit, count in run().items():
+            totals[unit] = totals.get(unit, 0) + count
+        elapsed = time.perf_counter() - start
+
+    return {f"{unit}_per_second": count / elapsed for unit, count in totals.items()}
+
+
+def get_env(config: dict, seed: int) -> PaddedEnv:
+    env = PaddedEnv(
+        R=config["env"]["R"],
+        C=config["env"]["C"],
+        N=config["env"]["N"],
+        max_R=config["env"]["R"],
+        max_C=config["env"]["C"],
+        max_N=config["env"]["N"],
+        auto_move=True,
+        speedy=True,
+    )
+    env.reset(seed)
+    return env
+
+
+def random_action(env: PaddedEnv) -> int:
+    return int(np.random.choice(np.flatnonzero(env.mask)))
+
+
+def random_episode(config: dict, seed: int) -> dict:
+    """A full episode of random moves and random policy targets, recorded as InferenceProcess would"""
+    env = get_env(config, seed)
+    recorder = EpisodeRecorder(env, config)
+    n_actions = 2 * config["env"]["R"] * config["env"]["C"]
+
+    while not env.terminated:
+        action = random_action(env)
+        probabilities = torch.softmax(torch.randn(n_actions, dtype=torch.float64), 0)
+        recorder.add(probabilities, env, action)
+        env.step(action)
+
+    episode = recorder.finish(env)
+    env.close()
+    return episode
+
+
+def benchmark_env(config: dict, seconds: float, seed: int) -> dict:
+    env = get_env(config, seed)
+    episodes = [0]
+
+    def step() -> dict:
+        for _ in range(100):
+            if env.terminated:
+                episodes[0] += 1
+                env.reset(seed + episodes[0])
+            env.step(random_action(env))
+        return {"steps": 100}
+
+    def copy_env() -> dict:
+        for _ in range(100):
+            env.copy().close()
+        return {"copies": 100}
+
+    R, C, N = config["env"]["R"], config["env"]["C"], config["env"]["N"]
+    bay = np.empty((R, C), dtype=np.float32)
+    flat_T = np.empty(N * (N - 1) // 2, dtype=np.float32)
+    containers_left = np.empty(1, dtype=np.float32)
+    mask = np.empty(2 * R * C, dtype=np.float32)
+
+    def encode() -> dict:
+        # A step between encodings, so the observation cache of the env is never reused
+        for _ in range(100):
+            if env.terminated:
+                episodes[0] += 1
+                env.reset(seed + episodes[0])
+            env.step(random_action(env))
+            env.write_observation(bay, flat_T, containers_left, mask)
+        return {"encodes": 100}
+
+    def encode_compact() -> dict:
+        for _ in range(100):
+            if env.terminated:
+                episodes[0] += 1
+                env.reset(seed + episodes[0])
+            env.step(random_action(env))
+            env.compact_state
+        return {"encodes": 100}
+
+    results = {
+        "step": measure(step, seconds),
+        "copy": measure(copy_env, seconds),
+        "step_and_encode": measure(encode, seconds),
+        "step_and_encode_compact": measure(encode_compact, seconds),
+    }
+    env.close()
+    return results
+
+
+def benchmark_mcts(config: dict, seconds: float, seed: int) -> dict:
+    """One search per call from the current state, without tree reuse, then plays its most visited action"""
+    evaluator = StubEvaluator(config)
+    state = {"env": get_env(config, seed), "episode": 0}
+    phase_timer.enabled = True  # find_leaf_calls counts the simulations
+    phase_timer.pop()
+
+    def search() -> dict:
+        env = state["env"]
+        n_evaluations = evaluator.n_evaluations
+        probabilities, tree, _, _ = alpha_zero_search(
+            env, evaluator, config, MinMaxStats(), None, {}
+        )
+        close_envs_in_tree(tree)
+        env.step(int(torch.argmax(probabilities)))
+
+        if env.terminated:
+            env.close()
+            state["episode"] += 1
+            state["env"] = get_env(config, seed + state["episode"])
+
+        return {
+            "simulations": phase_timer.pop().get("find_leaf_calls", 0),
+            "evaluations": evaluator.n_evaluations - n_evaluations,
+            "moves": 1,
+        }
+
+    results = measure(search, seconds)
+    phase_timer.enabled = False
+    state["env"].close()
+    return results
+
+
+def benchmark_gpu_process(
+    config: dict,
+    seconds: float,
+    seed: int,
+    device: str,
+    pretrained: PretrainedModel,
+    batch_sizes: list[int],
+) -> dict:
+    """Drives GPUProcess in this process: every pipe sends one request, then one batch is received,
+    evaluated and answered. Includes the pipe transfers, but not the waiting on other processes."""
+    env = get_env(config, seed)
+    if config["inference"].get("compact_transport", False):
+        request = env.compact_state
+    else:
+        request = (
+            env.bay,
+            env.flat_T,
+            np.array([env.containers_left], dtype=np.float32),
+            env.mask,
+        )
+    env.close()
+    results = {}
+
+    for batch_size in batch_sizes:
+        gpu_config = copy.deepcopy(config)
+        gpu_config["inference"]["batch_size"] = batch_size
+        gpu_config["inference"]["telemetry_interval"] = 0
+        pipes = [mp.Pipe() for _ in range(batch_size)]
+        gpu = GPUProcess(pipes, None, device, pretrained, gpu_config)
+
+        def evaluate_batch() -> dict:
+            for _, conn in pipes:
+                conn.send(request)
+            while not gpu._queue_is_full():
+                gpu._receive_data()
+            policies, values = gpu._process_data()
+            gpu._send_data(policies, values)
+            gpu._reset_queue()
+            for _, conn in pipes:
+                conn.recv()
+            return {"evaluations": batch_size, "batches": 1}
+
+        results[f"batch_size_{batch_size}"] = measure(evaluate_batch, seconds)
+
+        for parent_conn, child_conn in pipes:
+            parent_conn.close()
+            child_conn.close()
+
+    return results
+
+
+def benchmark_buffer(
+    config: dict, seconds: float, episodes: list[dict]
+) -> tuple[dict, ReplayBuffer]:
+    buffer = ReplayBuffer(config)
+    batch_size = config["train"]["batch_size"]
+    next_episode = [0]
+
+    def extend() -> dict:
+        episode = episodes[next_episode[0] % len(episodes)]
+        next_episode[0] += 1
+        buffer.extend(episode)
+        return {"episodes": 1, "rows": len(episode["value"])}
+
+    def sample() -> dict:
+        buffer.sample(batch_size)
+        return {"batches": 1, "rows": batch_size}
+
+    results = {"extend": measure(extend, seconds)}
+    while len(buffer) < batch_size:
+        extend()
+    results["sample"] = measure(sample, seconds)
+
+    if buffer.prioritized:
+
+        def sample_prioritized() -> dict:
+            indices = buffer.sample_prioritized(batch_size)[6]
+            buffer.update_priorities(indices, torch.rand(batch_size))
+            return {"batches": 1, "rows": batch_size}
+
+        results["sample_prioritized"] = measure(sample_prioritized, seconds)
+
+    return results, buffer
+
+
+def benchmark_train(
+    config: dict,
+    seconds: float,
+    device: str,
+    pretrained: PretrainedModel,
+    buffer: ReplayBuffer,
+) -> dict:
+    model = init_model(config, device, pretrained)
+    model.train()
+    optimizer = get_optimizer(model, config)
+    scheduler = get_scheduler(optimizer, config)
+
+    def train() -> dict:
+        train_batch(model, buffer, optimizer, scheduler, config)
+        return {"batches": 1, "samples": config["train"]["batch_size"]}
+
+    return measure(train, seconds)
+
+
+def get_machine_info() -> dict:
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "cuda": torch.cuda.get_device_name() if torch.cuda.is_available() else None,
+        "git_commit": _git(["rev-parse", "HEAD"]),
+        "git_dirty": _git(["status", "--porcelain", "--untracked-files=no"]) != "",
+    }
+
+
+def _git(args: list[str]) -> str:
+    try:
+        return subprocess.run(
+            ["git", *args],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_benchmark_config(config: dict, buffer_size: int) -> dict:
+    """The config, with a replay buffer that fits in memory here and never touches the real buffer files"""
+    config = copy.deepcopy(config)
+    config["wandb"]["should_log"] = False
+    config["replay_buffer"]["max_size"] = min(
+        config["replay_buffer"]["max_size"], buffer_size
+    )
+    config["replay_buffer"]["checkpoint_path"] = ""
+    config["replay_buffer"]["storage_dir"] = tempfile.mkdtemp(prefix="throughput")
+    config["replay_buffer"]["max_concurrent_writers"] = 1
+    return config
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--config",
+        default="config.json" if torch.cuda.is_available() else "local_config.json",
+    )
+    parser.add_argument(
+        "--output", default=None, help="Defaults to throughput-<time>.json"
+    )
+    parser.add_argument("--seconds", type=float, default=5, help="Per measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads")
+    parser.add_argument(
+        "--components", nargs="+", choices=COMPONENTS, default=COMPONENTS
+    )
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128]
+    )
+    parser.add_argument("--buffer-size", type=int, default=200000)
+    parser.add_argument(
+        "--n-episodes",
+        type=int,
+        default=50,
+        help="Random episodes cycled into the buffer",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    config = get_benchmark_config(get_config(args.config), args.buffer_size)
+    # Random weights, the speed does not depend on them
+    pretrained = PretrainedModel(
+        wandb_run=None,
+        wandb_model=None,
+        artifact=None,
+        local_model=None,
+        checkpoint=None,
+    )
+    results = {}
+
+    if "env" in args.components:
+        results["env"] = benchmark_env(config, args.seconds, args.seed)
+    if "mcts" in args.components:
+        results["mcts"] = benchmark_mcts(config, args.seconds, args.seed)
+    if "gpu_process" in args.components:
+        results["gpu_process"] = benchmark_gpu_process(
+            config, args.seconds, args.seed, args.device, pretrained, args.batch_sizes
+        )
+    if "buffer" in args.components or "train" in args.components:
+        episodes = [
+            random_episode(config, args.seed + i) for i in range(args.n_episodes)
+        ]
+        results["buffer"], buffer = benchmark_buffer(config, args.seconds, episodes)
+    if "train" in args.components:
+        results["train"] = benchmark_train(
+            config, args.seconds, args.device, pretrained, buffer
+        )
+
+    output = {
+        "machine": get_machine_info(),
+        "settings": {**vars(args), "env": config["env"], "mcts": config["mcts"]},
+        "results": results,
+    }
+    path = args.output or f"throughput-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(path, "w") as f:
+        json.dump(output, f, indent=2)
+
+    print(json.dumps(results, indent=2))
+    print(f"Wrote {path}")